@@ -1,11 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
+import json
 import os
-from file import PDFFile
-from database import MongoDB
-from openaiclient import storeFile, query_question
-from PyPDF2 import PdfReader
-from io import BytesIO
+import time
+from cache import AnswerCache
+from database import MongoDB, LIST_PAGE_SIZE
+from jobs import IngestJobs, FINISHED_STATES, job_to_dict
+from openaiclient import MODEL, client, query_question, stream_question, query_with_context, stream_with_context
+from retrieval import BACKENDS, backend_for, cache_scope, local_passages
+from locations import ordered_locations, resolve_locations
+from metrics import REGISTRY, REQUEST_SECONDS, PAYLOAD_BYTES, ANSWER_CACHE_ENTRIES
 import sys
 import traceback
 
@@ -13,6 +17,43 @@ app = Flask(__name__)
 CORS(app) 
 
 db = MongoDB("mongodb://localhost:27017/")
+answer_cache = AnswerCache(db.answers)
+app.config["OPENAI_CLIENT"] = client
+jobs = IngestJobs(db, openai_client=app.config["OPENAI_CLIENT"], answer_cache=answer_cache)
+
+def set_openai_client(openai_client):
+    """Send every OpenAI call from the routes and the ingest workers through another client, such as a test double"""
+    app.config["OPENAI_CLIENT"] = openai_client
+    jobs.openai_client = openai_client
+
+# Default and maximum number of pages returned by a single /api/get_pdf call
+PAGE_WINDOW = 20
+MAX_PAGE_WINDOW = 100
+
+# Largest page of books /api/get_all_pdfs will return
+MAX_LIST_PAGE_SIZE = 200
+
+# Seconds between job state checks on the upload progress stream
+PROGRESS_POLL_INTERVAL = 0.5
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.before_request
+def start_jobs():
+    # Not at import time: the reloader's watcher process imports this module too but never serves
+    jobs.start()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or "unknown"
+    if "request_start" in g:
+        # Streaming endpoints are timed until their headers are sent
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=endpoint, status=response.status_code)
+    if response.content_length is not None:
+        PAYLOAD_BYTES.observe(response.content_length, kind=f"response:{endpoint}")
+    return response
 
 # Error handler for all errors
 @app.errorhandler(Exception)
@@ -36,30 +77,57 @@ def upload():
         return jsonify({"error": "No file selected"}), 400
 
 
-    try:
-        doc = PdfReader(file)
-        pdf_file = PDFFile.extract_information_from_pdf(doc, file.filename, "", "")
+    job = jobs.submit(file.stream, file.filename)
 
-        file_store_id, vector_store_id = storeFile(pdf_file, file.filename)
+    if job.get("duplicate_of"):
+        return jsonify({
+            "message": "File already uploaded",
+            "job": job_to_dict(job)
+        })
 
-        pdf_file.file_store_id = file_store_id
-        pdf_file.vector_store_id = vector_store_id
+    return jsonify({
+        "message": "File queued for processing",
+        "job": job_to_dict(job)
+    }), 202
 
-        print(file_store_id, ":", vector_store_id);
+@app.route('/api/upload_status', methods=['GET'])
+def upload_status():
+    job_id = request.args.get('job_id')
 
-        db.save_pdf(pdf_file)
-    except Exception as e:
-        print("Stack Trace:")
-        traceback.print_exc(file=sys.stderr)
+    if job_id is None:
+        return jsonify({"error": "Job id is required"}), 400
 
-        print(e);
-        return jsonify({"error": str(e)}), 500
+    job = db.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
 
     return jsonify({
-        "message": "File uploaded successfully!",
-        "pdf_data": pdf_file.to_dict()
+        "job": job_to_dict(job)
     })
 
+@app.route('/api/upload_progress', methods=['GET'])
+def upload_progress():
+    job_id = request.args.get('job_id')
+
+    if job_id is None:
+        return jsonify({"error": "Job id is required"}), 400
+
+    if db.get_job(job_id) is None:
+        return jsonify({"error": "Job not found"}), 404
+
+    def stream():
+        last = None
+        while True:
+            job = job_to_dict(db.get_job(job_id))
+            if job != last:
+                yield f"data: {json.dumps(job)}\n\n"
+                last = job
+            if job["state"] in FINISHED_STATES:
+                return
+            time.sleep(PROGRESS_POLL_INTERVAL)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
 @app.route('/api/get_pdf', methods=['GET'])
 def get_pdf():
     title = request.args.get('title')
@@ -71,20 +139,47 @@ def get_pdf():
     if pdf_file is None:
         return jsonify({"error": "PDF not found"}), 404
 
+    if request.args.get('metadata_only', 'false').lower() in ('1', 'true'):
+        return jsonify({
+            "pdf_data": pdf_file.to_dict()
+        })
+
+    first = request.args.get('from', 1, type=int)
+    last = request.args.get('to', first + PAGE_WINDOW - 1, type=int)
+    if first < 1 or last < first:
+        return jsonify({"error": "Invalid page range"}), 400
+    last = min(last, first + MAX_PAGE_WINDOW - 1)
+
+    pages = db.get_pages(pdf_file, first, last)
+
     return jsonify({
-        "pdf_data": pdf_file.to_dict()
+        "pdf_data": pdf_file.to_dict(),
+        "from": first,
+        "to": last,
+        "pages": pages
     })
 
 @app.route('/api/get_all_pdfs', methods=['GET'])
 def get_all_pdfs():
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', LIST_PAGE_SIZE, type=int)
+
+    if limit < 1:
+        return jsonify({"error": "Limit must be positive"}), 400
+
     try:
-        pdfs = db.get_all_pdfs()
+        pdfs, next_cursor = db.get_all_pdfs(cursor, min(limit, MAX_LIST_PAGE_SIZE))
         return jsonify({
-            "pdf_files": pdfs
+            "pdf_files": pdfs,
+            "next_cursor": next_cursor
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+def passage_location(passage: dict) -> dict:
+    """Location of a locally retrieved passage, in the same shape resolve_locations returns"""
+    return {"page": passage["page"], "start": passage["start"], "end": passage["end"]}
+
 @app.route('/api/askquestion', methods=['GET'])
 def ask_question():
     title = request.args.get('title')
@@ -97,13 +192,118 @@ def ask_question():
     if pdf_file is None:
         return jsonify({"error": "PDF not found"}), 404
 
-    answer = query_question(question, pdf_file.file_store_id, pdf_file.vector_store_id);
+    scope = cache_scope(pdf_file)
+    answer = answer_cache.get(scope, MODEL, question)
+    if answer is None:
+        if backend_for(pdf_file) == "local":
+            passages = local_passages(db, pdf_file, question)
+            message, annotations = query_with_context(question, passages, app.config["OPENAI_CLIENT"])
+            locations = ordered_locations([passage_location(passage) for passage in passages])
+        else:
+            message, annotations, results = query_question(question, pdf_file.file_store_id, pdf_file.vector_store_id, app.config["OPENAI_CLIENT"]);
+            locations = resolve_locations(db, pdf_file, results)
+        answer = (message, annotations, locations)
+        answer_cache.put(scope, MODEL, question, *answer)
 
     return jsonify({
         "answer": answer[0],
-        "annotations": answer[1]
+        "annotations": answer[1],
+        "locations": answer[2]
+    })
+
+@app.route('/api/askquestion_stream', methods=['GET'])
+def ask_question_stream():
+    title = request.args.get('title')
+    question = request.args.get('question')
+
+    if title is None or question is None:
+        return jsonify({"error": "Title and question are required"}), 400
+
+    pdf_file = db.get_pdf(title)
+    if pdf_file is None:
+        return jsonify({"error": "PDF not found"}), 404
+
+    def sse(event: str, data) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    scope = cache_scope(pdf_file)
+    openai_client = app.config["OPENAI_CLIENT"]
+
+    def stream():
+        cached = answer_cache.get(scope, MODEL, question)
+        if cached is not None:
+            yield sse("delta", cached[0])
+            yield sse("annotations", cached[1])
+            yield sse("locations", cached[2])
+            yield sse("done", {"answer": cached[0], "cached": True})
+            return
+
+        message = []
+        annotations = ""
+        locations = []
+        try:
+            if backend_for(pdf_file) == "local":
+                passages = local_passages(db, pdf_file, question)
+                locations = ordered_locations([passage_location(passage) for passage in passages])
+                yield sse("locations", locations)
+                events = stream_with_context(question, passages, openai_client)
+            else:
+                events = stream_question(question, pdf_file.file_store_id, pdf_file.vector_store_id, openai_client)
+
+            for event, data in events:
+                if event == "delta":
+                    message.append(data)
+                elif event == "annotations":
+                    annotations = data
+                elif event == "results":
+                    locations = resolve_locations(db, pdf_file, data)
+                    yield sse("locations", locations)
+                    continue
+                yield sse(event, data)
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            yield sse("error", str(e))
+            return
+
+        answer = "".join(message)
+        answer_cache.put(scope, MODEL, question, answer, annotations, locations)
+        yield sse("done", {"answer": answer, "cached": False})
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/retrieval_backend', methods=['POST'])
+def set_retrieval_backend():
+    title = request.args.get('title')
+    backend = request.args.get('backend')
+
+    if title is None:
+        return jsonify({"error": "Title is required"}), 400
+
+    if backend is not None and backend not in BACKENDS:
+        return jsonify({"error": f"Backend must be one of {', '.join(BACKENDS)}"}), 400
+
+    pdf_file = db.get_pdf(title)
+    if pdf_file is None:
+        return jsonify({"error": "PDF not found"}), 404
+
+    db.set_retrieval_backend(pdf_file.filename, backend)
+    pdf_file.retrieval_backend = backend
+
+    return jsonify({
+        "pdf_data": pdf_file.to_dict(),
+        "retrieval_backend": backend_for(pdf_file)
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    ANSWER_CACHE_ENTRIES.set(answer_cache.stats()["memory_entries"])
+
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify(answer_cache.stats())
+
 
 if __name__ == '__main__':
     os.environ["FLASK_ENV"] = "development"
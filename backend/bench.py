@@ -0,0 +1,259 @@
+"""Offline benchmark of the upload, get_pdf, list, askquestion and askquestion_stream endpoints.
+
+    python bench.py --sizes 10,100,500 --requests 50 --output results.json
+    python bench.py --baseline results.json
+
+Runs the Flask app in-process against generated PDFs, a stubbed OpenAI client
+and mongomock (pip install mongomock), so it needs no network or database.
+With --baseline it exits non-zero if any p95 latency regressed by more than
+--tolerance.
+"""
+from metrics import percentile
+from statistics import median
+from types import SimpleNamespace
+from typing import Optional
+import argparse
+import functools
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+
+WORDS = ("the", "energy", "system", "chapter", "theory", "cell", "market", "force", "history", "model",
+         "student", "function", "value", "process", "structure", "result", "example", "figure", "method", "data")
+
+def generate_pdf(path: str, page_count: int, words_per_page: int = 300, seed: int = 0):
+    """Write a minimal PDF with page_count pages of generated Helvetica text"""
+    rng = random.Random(seed)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [" + " ".join(f"{4 + 2 * i} 0 R" for i in range(page_count)) + f"] /Count {page_count} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    for i in range(page_count):
+        words = [rng.choice(WORDS) for _ in range(words_per_page)]
+        lines = [" ".join(words[j:j + 12]) for j in range(0, len(words), 12)]
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 10 Tf 12 TL 50 750 Td ({seed}-{i + 1}) Tj T* {text} ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+
+    with open(path, "wb") as f:
+        f.write(out)
+
+class StubOpenAI:
+    """Just enough of the OpenAI client for the app and its tests, recording each call, with an optional fixed latency"""
+
+    def __init__(self, latency: float = 0.0, answer: Optional[str] = None, results: Optional[list[str]] = None,
+                 fail_at: Optional[int] = None, upload_error: Optional[Exception] = None):
+        self.latency = latency
+        # Fixed answer and file_search result texts; by default the question is echoed back with a slice of the book
+        self.answer = answer
+        self.results = results
+        # Raise instead of yielding the stream event at this index
+        self.fail_at = fail_at
+        # Raised from files.create, to fail an ingest job
+        self.upload_error = upload_error
+        self.calls = []
+        self.ids = itertools.count()
+        self.texts = {}
+        self.files = SimpleNamespace(create=self._create_file)
+        self.vector_stores = SimpleNamespace(
+            create=self._create_vector_store,
+            files=SimpleNamespace(create=self._attach_file)
+        )
+        self.responses = SimpleNamespace(create=self._respond)
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _create_file(self, file, purpose):
+        self.calls.append("files.create")
+        self._wait()
+        if self.upload_error is not None:
+            raise self.upload_error
+        file_id = f"file-{next(self.ids)}"
+        self.texts[file_id] = file[1]
+        return SimpleNamespace(id=file_id)
+
+    def _create_vector_store(self, name):
+        self.calls.append("vector_stores.create")
+        self._wait()
+        return SimpleNamespace(id=f"vs-{next(self.ids)}")
+
+    def _attach_file(self, file_id, vector_store_id):
+        self.calls.append("vector_stores.files.create")
+        self._wait()
+        self.texts[vector_store_id] = self.texts.get(file_id, "")
+        return SimpleNamespace(id=file_id)
+
+    def _respond(self, model, input, tools=None, include=None, stream=False):
+        self.calls.append("responses.create")
+        self._wait()
+        answer = self.answer if self.answer is not None else f"Answer to: {input[:40]}"
+        output = [SimpleNamespace(type="message", content=[SimpleNamespace(text=answer)])]
+        if tools:
+            texts = self.results
+            if texts is None:
+                # Hand back an 800-character slice of the book as the file_search result
+                text = self.texts.get(tools[0]["vector_store_ids"][0], "")
+                start = random.randrange(max(len(text) - 800, 1))
+                texts = [text[start:start + 800]]
+            output.insert(0, SimpleNamespace(type="file_search_call", results=[SimpleNamespace(text=text) for text in texts]))
+        if stream:
+            return self._events(output)
+        return SimpleNamespace(output=output, output_text=answer)
+
+    def _events(self, output: list):
+        """The output as the stream events the app reads: finished file_search calls, then the answer word by word"""
+        events = [SimpleNamespace(type="response.created")]
+        events.extend(SimpleNamespace(type="response.output_item.done", item=item) for item in output[:-1])
+        events.extend(SimpleNamespace(type="response.output_text.delta", delta=delta)
+                      for delta in re.findall(r"\s*\S+", output[-1].content[0].text))
+        events.append(SimpleNamespace(type="response.completed"))
+
+        for index, event in enumerate(events):
+            if index == self.fail_at:
+                raise Exception("stream interrupted")
+            yield event
+
+def summarize(samples: list[float], elapsed: float) -> dict:
+    return {
+        "n": len(samples),
+        "throughput": len(samples) / elapsed if elapsed else 0.0,
+        "p50_ms": median(samples) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000
+    }
+
+def timed_calls(calls) -> dict:
+    samples = []
+    start = time.perf_counter()
+    for call in calls:
+        call_start = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - call_start)
+    return summarize(samples, time.perf_counter() - start)
+
+def check(response, status: int = 200):
+    if response.status_code != status:
+        raise Exception(f"{response.request.path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+    return response
+
+def run(sizes: list[int], uploads: int, requests: int, latency: float, workdir: str) -> dict:
+    import app
+
+    app.set_openai_client(StubOpenAI(latency))
+    client = app.app.test_client()
+    rng = random.Random(0)
+    results = {}
+
+    for size in sizes:
+        titles = [f"book-{size}-{i}.pdf" for i in range(uploads)]
+        for i, name in enumerate(titles):
+            generate_pdf(os.path.join(workdir, name), size, seed=size * 1000 + i)
+
+        def upload(name: str):
+            with open(os.path.join(workdir, name), "rb") as f:
+                job = check(client.post('/api/upload', data={'pdf': (f, name)}), 202).json["job"]
+            while job["state"] not in ("done", "failed"):
+                time.sleep(0.005)
+                job = check(client.get(f"/api/upload_status?job_id={job['job_id']}")).json["job"]
+            if job["state"] == "failed":
+                raise Exception(f"upload of {name} failed: {job['error']}")
+
+        results[f"upload[{size}p]"] = timed_calls([functools.partial(upload, name) for name in titles])
+        title = titles[0]
+
+        def get_window():
+            first = rng.randint(1, size)
+            check(client.get('/api/get_pdf', query_string={'title': title, 'from': first, 'to': first + 19}))
+
+        results[f"get_pdf[{size}p]"] = timed_calls([get_window] * requests)
+
+        questions = iter(range(requests))
+        def ask():
+            check(client.get('/api/askquestion', query_string={'title': title, 'question': f"question {next(questions)}"}))
+
+        results[f"askquestion[{size}p]"] = timed_calls([ask] * requests)
+        results[f"askquestion_cached[{size}p]"] = timed_calls(
+            [lambda: check(client.get('/api/askquestion', query_string={'title': title, 'question': "question 0"}))] * requests)
+
+        def ask_stream(question: str):
+            # Timed until the last event, not just the headers
+            events = check(client.get('/api/askquestion_stream', query_string={'title': title, 'question': question})).get_data(as_text=True)
+            if "event: done" not in events:
+                raise Exception(f"askquestion_stream did not finish: {events[-200:]}")
+
+        stream_questions = iter(range(requests))
+        results[f"askquestion_stream[{size}p]"] = timed_calls([lambda: ask_stream(f"streamed question {next(stream_questions)}")] * requests)
+        results[f"askquestion_stream_cached[{size}p]"] = timed_calls([lambda: ask_stream("streamed question 0")] * requests)
+
+    results["list"] = timed_calls([lambda: check(client.get('/api/get_all_pdfs'))] * requests)
+    return results
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,500", help="comma-separated page counts of generated books")
+    parser.add_argument("--uploads", type=int, default=3, help="books uploaded per size")
+    parser.add_argument("--requests", type=int, default=50, help="requests per read endpoint and book")
+    parser.add_argument("--openai-latency", type=float, default=0.0, help="seconds the stub OpenAI client sleeps per call")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare p95 latency against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 regression against the baseline")
+    args = parser.parse_args()
+
+    try:
+        import mongomock
+    except ImportError:
+        parser.error("the benchmark needs mongomock: pip install mongomock")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Must be set before the app modules are imported
+        os.environ["UPLOAD_DIR"] = os.path.join(workdir, "uploads")
+        os.environ["INDEX_DIR"] = os.path.join(workdir, "indexes")
+        os.environ.setdefault("OPEN_AI_API", "offline-benchmark")
+
+        with mongomock.patch(servers=(("localhost", 27017),)):
+            results = run([int(size) for size in args.sizes.split(",")], args.uploads, args.requests, args.openai_latency, workdir)
+
+    print(f"{'benchmark':<34} {'n':>5} {'ops/s':>10} {'p50 ms':>10} {'p95 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<34} {result['n']:>5} {result['throughput']:>10.1f} {result['p50_ms']:>10.2f} {result['p95_ms']:>10.2f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
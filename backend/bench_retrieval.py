@@ -0,0 +1,76 @@
+"""Compare retrieval latency of the local BM25 index against the OpenAI vector store.
+
+    python bench_retrieval.py --title "Some Book" "question one" "question two"
+    python bench_retrieval.py --synthetic 1000 "question one"
+
+--synthetic builds an index over generated pages and needs neither Mongo nor OpenAI.
+"""
+from statistics import median
+import argparse
+import random
+import time
+
+from metrics import percentile
+import retrieval
+
+DEFAULT_QUESTIONS = [
+    "What is the main argument of the first chapter?",
+    "How is energy conserved in a closed system?",
+    "Who are the main characters?"
+]
+
+def report(name: str, samples: list[float]):
+    print(f"{name:>8}: n={len(samples)} p50={median(samples) * 1000:.2f}ms p95={percentile(samples, 0.95) * 1000:.2f}ms")
+
+def timed(fn, questions: list[str], runs: int) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        for question in questions:
+            start = time.perf_counter()
+            fn(question)
+            samples.append(time.perf_counter() - start)
+    return samples
+
+def synthetic_pages(count: int, words_per_page: int = 400) -> list[str]:
+    rng = random.Random(0)
+    vocabulary = [f"term{i}" for i in range(20000)] + " ".join(DEFAULT_QUESTIONS).lower().split()
+    return [" ".join(rng.choices(vocabulary, k=words_per_page)) for _ in range(count)]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("questions", nargs="*", default=DEFAULT_QUESTIONS)
+    parser.add_argument("--title", help="title of an uploaded book")
+    parser.add_argument("--synthetic", type=int, metavar="PAGES", help="benchmark the local index on generated pages")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--local-only", action="store_true", help="skip the OpenAI vector store")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        pages = synthetic_pages(args.synthetic)
+        start = time.perf_counter()
+        chunks = retrieval.build_index("benchmark", pages)
+        print(f"built index over {len(pages)} pages / {chunks} chunks in {time.perf_counter() - start:.2f}s")
+
+        index = retrieval.load_index("benchmark")
+        report("local", timed(lambda q: index.search(q), args.questions, args.runs))
+        return
+
+    if args.title is None:
+        parser.error("either --title or --synthetic is required")
+
+    from database import MongoDB
+    db = MongoDB("mongodb://localhost:27017/")
+    pdf_file = db.get_pdf(args.title)
+    if pdf_file is None:
+        parser.error(f"no book titled {args.title!r}")
+
+    # Warm up so the one-off index build/load isn't counted against every query
+    retrieval.local_passages(db, pdf_file, args.questions[0])
+    report("local", timed(lambda q: retrieval.local_passages(db, pdf_file, q), args.questions, args.runs))
+
+    if not args.local_only:
+        from openaiclient import client
+        report("openai", timed(lambda q: client.vector_stores.search(pdf_file.vector_store_id, query=q), args.questions, args.runs))
+
+if __name__ == '__main__':
+    main()
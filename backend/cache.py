@@ -0,0 +1,111 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from metrics import ANSWER_CACHE_REQUESTS
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+from typing import Optional
+import hashlib
+import os
+import re
+import threading
+
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', 1024))
+ANSWER_CACHE_TTL = int(os.getenv('ANSWER_CACHE_TTL', 7 * 24 * 60 * 60))
+
+def normalize_question(question: str) -> str:
+    """Collapse whitespace and case so trivially different phrasings share a cache entry"""
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+class AnswerCache:
+    """Two-tier answer cache: an in-process LRU in front of a Mongo collection with a TTL index on expires_at"""
+
+    def __init__(self, collection: Collection, size: int = ANSWER_CACHE_SIZE, ttl: int = ANSWER_CACHE_TTL):
+        self.collection = collection
+        self.size = size
+        self.ttl = timedelta(seconds=ttl)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "mongo_hits": 0, "misses": 0}
+
+        # Each entry carries its own expiry, so changing ANSWER_CACHE_TTL never conflicts with the existing index
+        if 'created_at_1' in self.collection.index_information():
+            # Entries from before expires_at existed are dropped with the TTL index that covered them
+            try:
+                self.collection.drop_index('created_at_1')
+            except OperationFailure:
+                # Another process starting at the same time dropped it first
+                pass
+            self.collection.delete_many({'expires_at': {'$exists': False}})
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        self.collection.create_index('vector_store_id')
+
+    @staticmethod
+    def key(vector_store_id: str, model: str, question: str) -> str:
+        raw = "\0".join((vector_store_id, model, normalize_question(question)))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, vector_store_id: str, model: str, question: str) -> Optional[tuple]:
+        """Return a cached (answer, annotations, locations) tuple, or None"""
+        key = self.key(vector_store_id, model, question)
+        now = datetime.now(timezone.utc)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now < entry[0]:
+                self.entries.move_to_end(key)
+                self.counters["memory_hits"] += 1
+                ANSWER_CACHE_REQUESTS.inc(result="memory_hit")
+                return entry[1]
+
+        doc = self.collection.find_one({'_id': key})
+        # Mongo's TTL monitor only sweeps once a minute, so check expiry here as well
+        if doc is not None and now < doc['expires_at'].replace(tzinfo=timezone.utc):
+            value = (doc['answer'], doc['annotations'], doc.get('locations', []))
+            with self.lock:
+                self.counters["mongo_hits"] += 1
+                ANSWER_CACHE_REQUESTS.inc(result="mongo_hit")
+                self._remember(key, doc['expires_at'].replace(tzinfo=timezone.utc), value)
+            return value
+
+        with self.lock:
+            self.counters["misses"] += 1
+            ANSWER_CACHE_REQUESTS.inc(result="miss")
+        return None
+
+    def put(self, vector_store_id: str, model: str, question: str, answer: str, annotations, locations: list[dict]):
+        """Store an answer in both tiers"""
+        key = self.key(vector_store_id, model, question)
+        now = datetime.now(timezone.utc)
+        expires_at = now + self.ttl
+
+        self.collection.replace_one({'_id': key}, {
+            "vector_store_id": vector_store_id,
+            "model": model,
+            "question": normalize_question(question),
+            "answer": answer,
+            "annotations": annotations,
+            "locations": locations,
+            "created_at": now,
+            "expires_at": expires_at
+        }, upsert=True)
+
+        with self.lock:
+            self._remember(key, expires_at, (answer, annotations, locations))
+
+    def invalidate(self, vector_store_id: str):
+        """Drop every cached answer for a vector store"""
+        self.collection.delete_many({'vector_store_id': vector_store_id})
+
+        with self.lock:
+            # Memory entries are keyed by hash only, so start the in-process tier over
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {**self.counters, "memory_entries": len(self.entries)}
+
+    def _remember(self, key: str, expires_at: datetime, value: tuple):
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
@@ -1,44 +1,262 @@
-from pymongo import MongoClient
-from file import PDFFile
+from pymongo import MongoClient, ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError
+from file import PDFFile, PAGE_SEPARATOR
+from metrics import timed
 from typing import Optional
 from bson import ObjectId
+from datetime import datetime, timezone
+import uuid
 
 DATABASE = "book_ml_database";
 
+# Book lookups never need the legacy single-blob text
+METADATA_PROJECTION = {'text_content': 0};
+
+# Default number of books per /api/get_all_pdfs page
+LIST_PAGE_SIZE = 50;
+
+def new_pages_key(filename: str) -> str:
+    """Fresh key to store a version of a book's pages under, so it never overwrites pages readers may be using"""
+    return f"{filename}#{uuid.uuid4().hex}";
+
 class MongoDB:
     def __init__(self, mongo_db_connection):
-        self.collection = MongoClient(mongo_db_connection).client[DATABASE]['pdf_files'];
+        database = MongoClient(mongo_db_connection).client[DATABASE];
+        self.collection = database['pdf_files'];
+        self.pages = database['pdf_pages'];
+        self.jobs = database['ingest_jobs'];
+        self.answers = database['answer_cache'];
+
+        self.collection.create_index('title');
+        self.collection.create_index('content_hash', unique=True, partialFilterExpression={'content_hash': {'$type': 'string'}});
+        self.pages.create_index([('book', ASCENDING), ('page', ASCENDING)], unique=True);
+        self.jobs.create_index('state');
+        self.jobs.create_index('owner');
+        # At most one active job per content hash, so identical uploads arriving together are ingested once
+        self.jobs.create_index('content_hash', unique=True, partialFilterExpression={'active': True, 'content_hash': {'$type': 'string'}});
     
-    def save_pdf(self, pdf_file: PDFFile):
+    @timed("db_save_pdf")
+    def save_pdf(self, pdf_file: PDFFile, replace: bool = False, pages_saved: bool = False):
+        # Pages are written under a new key before any record points at them, unless the caller already stored them
+        if not pages_saved:
+            pdf_file.pages_key = new_pages_key(pdf_file.filename);
+            self.save_pages(pdf_file.pages_key, pdf_file.pages);
+
+        if replace:
+            previous = self.collection.find_one({'_id': pdf_file.filename}, {'pages_key': 1});
+            self.collection.replace_one({"_id": pdf_file.filename}, pdf_file.to_dict(), upsert=True);
+            # Readers switch to the new pages with the record; only then are the old ones removed
+            previous_key = (previous.get('pages_key') or pdf_file.filename) if previous is not None else None;
+            if previous_key is not None and previous_key != pdf_file.pages_key:
+                self.delete_pages(previous_key);
+            return True;
+
         try:
             self.collection.insert_one({
                 "_id": pdf_file.filename,
                 **pdf_file.to_dict()
             });
-            return True;
         except Exception as e:
-            if e.code == 11000:
+            if not pages_saved:
+                self.delete_pages(pdf_file.pages_key);
+            if getattr(e, 'code', None) == 11000:
                 raise Exception("PDF already exists");
             else:
                 raise e;
-    
+
+        return True;
+
+    def save_pages(self, key: str, pages: list[str]):
+        """Store each page of a book as its own document, keyed by the book's pages_key and page number"""
+        self.save_page_batch(key, dict(enumerate(pages, start=1)));
+
+    def save_page_batch(self, key: str, pages: dict[int, str]):
+        """Store some pages of a book by number, skipping any already stored under key"""
+        if not pages:
+            return;
+
+        # Pages that exist already are identical: a resumed extraction or a concurrent migration wrote them
+        try:
+            self.pages.insert_many([
+                { "book": key, "page": number, "text": text }
+                for number, text in pages.items()
+            ], ordered=False);
+        except BulkWriteError as e:
+            if any(error['code'] != 11000 for error in e.details['writeErrors']):
+                raise e;
+
+    def delete_pages(self, key: str):
+        """Remove every page stored under key"""
+        self.pages.delete_many({'book': key});
+
+    @timed("db_get_pdf")
     def get_pdf(self, title: str) -> Optional[PDFFile]:
-        """Retrieve PDFFile from database by title"""
-        pdf_dict = self.collection.find_one({'title': title})
+        """Retrieve PDFFile metadata from database by title"""
+        pdf_dict = self.collection.find_one({'title': title}, METADATA_PROJECTION)
         
         if not pdf_dict:
             return None
         return PDFFile.from_dict(pdf_dict)
 
-    def get_all_pdfs(self) -> list[dict]:
-        """Get all PDFs (basic info only)"""
+    def get_pdf_by_filename(self, filename: str) -> Optional[PDFFile]:
+        """Retrieve PDFFile metadata from database by filename"""
+        pdf_dict = self.collection.find_one({'_id': filename}, METADATA_PROJECTION)
+
+        if not pdf_dict:
+            return None
+        return PDFFile.from_dict(pdf_dict)
+
+    def get_pdf_by_hash(self, content_hash: str) -> Optional[PDFFile]:
+        """Retrieve PDFFile metadata for a book with the given content hash"""
+        pdf_dict = self.collection.find_one({'content_hash': content_hash}, METADATA_PROJECTION)
 
-        pdfs =  self.collection.find({}, {
+        if not pdf_dict:
+            return None
+        return PDFFile.from_dict(pdf_dict)
+
+    def set_retrieval_backend(self, filename: str, backend: Optional[str]):
+        """Choose the retrieval backend for one book; None falls back to the default"""
+        self.collection.update_one({'_id': filename}, {'$set': {'retrieval_backend': backend}});
+
+    @timed("db_get_pages")
+    def get_pages(self, pdf_file: PDFFile, first: int, last: int) -> list[dict]:
+        """Get pages first..last (1-based, inclusive) of a book"""
+        if pdf_file.page_count is None:
+            self._migrate_legacy_pages(pdf_file)
+
+        pages = self.pages.find(
+            {'book': pdf_file.pages_key, 'page': {'$gte': first, '$lte': last}},
+            {'_id': 0, 'page': 1, 'text': 1}
+        ).sort('page', ASCENDING);
+
+        return list(pages);
+
+    def get_pages_by_number(self, pdf_file: PDFFile, numbers: list[int]) -> dict[int, str]:
+        """Get the text of specific pages of a book, keyed by page number"""
+        pages = self.pages.find(
+            {'book': pdf_file.pages_key, 'page': {'$in': list(set(numbers))}},
+            {'_id': 0, 'page': 1, 'text': 1}
+        );
+
+        return {page['page']: page['text'] for page in pages};
+
+    def _migrate_legacy_pages(self, pdf_file: PDFFile):
+        """Split a book stored as one text_content blob into page documents"""
+        legacy = self.collection.find_one({'_id': pdf_file.filename}, {'text_content': 1, 'page_count': 1})
+        if legacy is not None and legacy.get('page_count') is not None:
+            # Another request finished the migration since pdf_file was read
+            pdf_file.page_count = legacy['page_count']
+            return;
+
+        text = legacy.get('text_content', "") if legacy else ""
+        pages = [page for page in text.split(PAGE_SEPARATOR) if page.strip()]
+
+        # Concurrent first reads may migrate the same book at once. The split is deterministic, so
+        # pages someone else already inserted are identical, and nothing is deleted that a reader could miss
+        self.save_pages(pdf_file.pages_key, pages);
+
+        # Only mark the book migrated once every page exists, so readers never see a partial book
+        self.collection.update_one(
+            {'_id': pdf_file.filename, 'page_count': None},
+            {'$set': {'page_count': len(pages)}, '$unset': {'text_content': ""}}
+        );
+        pdf_file.page_count = len(pages)
+
+    @timed("db_list_pdfs")
+    def get_all_pdfs(self, cursor: Optional[str] = None, limit: int = LIST_PAGE_SIZE) -> tuple[list[dict], Optional[str]]:
+        """Get one page of PDFs (basic info only) ordered by filename, plus the cursor for the next page"""
+        query = {} if cursor is None else {'_id': {'$gt': cursor}};
+
+        pdfs = list(self.collection.find(query, {
             'title': 1,
-            'author': 1
-        });
+            'author': 1,
+            'filename': 1,
+            'page_count': 1
+        }).sort('_id', ASCENDING).limit(limit + 1));
+
+        # The extra record only tells us whether another page exists
+        next_cursor = None;
+        if len(pdfs) > limit:
+            pdfs = pdfs[:limit];
+            next_cursor = pdfs[-1]["_id"];
+
+        ret = [{
+            "title": i["title"],
+            "author": i["author"],
+            "filename": i.get("filename"),
+            "page_count": i.get("page_count")
+        } for i in pdfs];
+
+        return ret, next_cursor;
+
+    def create_job(self, job_id: str, filename: str, path: str, state: str, content_hash: Optional[str] = None, owner: Optional[str] = None, lease_until: Optional[datetime] = None) -> Optional[dict]:
+        """Record a new ingestion job, optionally already claimed by owner; None if an active job has the same content_hash"""
+        now = datetime.now(timezone.utc)
+        job = {
+            "_id": job_id,
+            "filename": filename,
+            "path": path,
+            "content_hash": content_hash,
+            "state": state,
+            "pages_done": 0,
+            "page_count": None,
+            "error": None,
+            "active": True,
+            "owner": owner,
+            "lease_until": lease_until,
+            "created_at": now,
+            "updated_at": now
+        }
+        try:
+            self.jobs.insert_one(job);
+        except Exception as e:
+            if getattr(e, 'code', None) == 11000:
+                return None;
+            raise e;
+        return job;
+
+    def update_job(self, job_id: str, **fields):
+        """Update fields of an ingestion job"""
+        self.jobs.update_one(
+            {'_id': job_id},
+            {'$set': {**fields, 'updated_at': datetime.now(timezone.utc)}}
+        );
+
+    def finish_job(self, job_id: str, **fields):
+        """Update fields of an ingestion job that has reached a final state, releasing its content hash"""
+        self.jobs.update_one(
+            {'_id': job_id},
+            {'$set': {**fields, 'updated_at': datetime.now(timezone.utc)}, '$unset': {'active': ""}}
+        );
+
+    def get_active_job(self, content_hash: str) -> Optional[dict]:
+        """Get the unfinished ingestion job for a content hash, if there is one"""
+        return self.jobs.find_one({'content_hash': content_hash, 'active': True});
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """Get an ingestion job by id"""
+        return self.jobs.find_one({'_id': job_id});
 
-        ret = [{ "title": i["title"], "author": i["author"] } for i in pdfs];
+    def get_unfinished_jobs(self, finished_states: tuple) -> list[dict]:
+        """Get every ingestion job that has not reached one of finished_states"""
+        return list(self.jobs.find({'state': {'$nin': list(finished_states)}}).sort('created_at', ASCENDING));
 
+    def claim_job(self, job_id: str, owner: str, lease_until: datetime, finished_states: tuple) -> Optional[dict]:
+        """Atomically take an unfinished job whose lease has lapsed, returning it, or None if someone else holds it"""
+        now = datetime.now(timezone.utc)
+        return self.jobs.find_one_and_update(
+            {
+                '_id': job_id,
+                'state': {'$nin': list(finished_states)},
+                '$or': [{'lease_until': None}, {'lease_until': {'$lt': now}}]
+            },
+            {'$set': {'owner': owner, 'lease_until': lease_until, 'updated_at': now}},
+            return_document=ReturnDocument.AFTER
+        );
 
-        return ret;
\ No newline at end of file
+    def renew_job_leases(self, owner: str, lease_until: datetime, finished_states: tuple):
+        """Extend the lease on every unfinished job owner holds"""
+        self.jobs.update_many(
+            {'owner': owner, 'state': {'$nin': list(finished_states)}},
+            {'$set': {'lease_until': lease_until}}
+        );
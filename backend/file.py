@@ -1,41 +1,159 @@
 from dataclasses import dataclass
-from typing import Optional
+from typing import Callable, Iterator, NamedTuple, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from PyPDF2 import PdfReader
+from metrics import span, STAGE_SECONDS, PAGES_EXTRACTED
+import multiprocessing
+import os
+import threading
+import time
+
+# Separator between pages when a book is flattened into a single text blob
+PAGE_SEPARATOR = "<br>"
+
+# Pages handed to a worker process per task
+PAGES_PER_TASK = 25
+
+# Books shorter than this are extracted on the calling thread; a process pool isn't worth it
+MIN_PAGES_FOR_POOL = 50
+
+# Size of the extraction pool shared by every upload in this process
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', os.cpu_count() or 1))
+
+class ExtractedPage(NamedTuple):
+    number: int
+    text: str
+    error: Optional[str]
+    seconds: float
+
+def _iter_page_range(doc: PdfReader, first: int, last: int) -> Iterator[ExtractedPage]:
+    """Extract pages first..last-1 (0-based), recording failures instead of raising"""
+    for index in range(first, last):
+        start = time.perf_counter()
+        try:
+            text, error = doc.pages[index].extract_text() or "", None
+        except Exception as e:
+            text, error = "", str(e)
+        yield ExtractedPage(index + 1, text, error, time.perf_counter() - start)
+
+def _extract_page_range(path: str, first: int, last: int) -> list[ExtractedPage]:
+    """Worker task: open the PDF at path and extract one range of pages"""
+    return list(_iter_page_range(PdfReader(path), first, last))
+
+# Created on first use and kept for the life of the process
+_pool = None
+_pool_lock = threading.Lock()
+
+def _extraction_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned rather than forked: the server extracts from request and ingest threads, and a
+            # forked child can inherit locks those threads were holding
+            _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+def _discard_pool(pool: ProcessPoolExecutor):
+    """Forget a pool whose worker died so the next book starts a new one"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def iter_pages(path: str, workers: Optional[int] = None) -> Iterator[ExtractedPage]:
+    """Yield every page of the PDF at path in order; workers=1 extracts on the calling thread, otherwise it caps this book's share of the pool"""
+    doc = PdfReader(path)
+    page_count = len(doc.pages)
+
+    if workers == 1 or page_count < MIN_PAGES_FOR_POOL:
+        yield from _iter_page_range(doc, 0, page_count)
+        return
+
+    workers = min(workers or EXTRACT_WORKERS, EXTRACT_WORKERS)
+    ranges = iter([(first, min(first + PAGES_PER_TASK, page_count)) for first in range(0, page_count, PAGES_PER_TASK)])
+
+    pool = _extraction_pool()
+    # Keep a bounded number of ranges in flight so finished pages don't pile up in memory
+    pending = deque()
+    try:
+        for first, last in ranges:
+            pending.append(pool.submit(_extract_page_range, path, first, last))
+            if len(pending) >= workers * 2:
+                break
+
+        while pending:
+            pages = pending.popleft().result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(pool.submit(_extract_page_range, path, *next_range))
+            yield from pages
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+    finally:
+        # The pool outlives this book; only drop its remaining ranges
+        for future in pending:
+            future.cancel()
 
 @dataclass
 class PDFFile:
     title: Optional[str]
     author: Optional[str]
-    text_content: str
+    pages: list[str]
     filename: str
     
-    def __init__(self, filename: str, vector_store_id: str, file_store_id: str, title: Optional[str] = None, author: Optional[str] = None, text_content: str = ""):
+    def __init__(self, filename: str, vector_store_id: str, file_store_id: str, title: Optional[str] = None, author: Optional[str] = None, pages: Optional[list[str]] = None, page_count: Optional[int] = None, failed_pages: Optional[list[int]] = None, retrieval_backend: Optional[str] = None, content_hash: Optional[str] = None, pages_key: Optional[str] = None):
         self.filename = filename
         self.vector_store_id = vector_store_id
         self.file_store_id = file_store_id
         self.title = title if title is not None else filename
         self.author = author
-        self.text_content = text_content
+        self.pages = pages if pages is not None else []
+        # page_count stays None for legacy records whose pages were never split out
+        self.page_count = page_count if page_count is not None or pages is None else len(pages)
+        self.failed_pages = failed_pages if failed_pages is not None else []
+        # None means use the server-wide default backend
+        self.retrieval_backend = retrieval_backend
+        # SHA-256 of the uploaded bytes, used to spot the same book under another filename
+        self.content_hash = content_hash
+        # Key of this version's documents in pdf_pages; books stored before versioning use their filename
+        self.pages_key = pages_key if pages_key is not None else filename
+
+    @property
+    def text_content(self) -> str:
+        """Whole book as a single string, non-empty pages joined by PAGE_SEPARATOR"""
+        return "".join(PAGE_SEPARATOR + page for page in self.pages if page.strip())
     
     def to_dict(self) -> dict:
-        """Convert the PDFFile object to a dictionary"""
+        """Convert the PDFFile metadata to a dictionary (page text is stored separately)"""
         return {
             "filename": self.filename,
             "title": self.title,
             "author": self.author,
-            "text_content": self.text_content,
+            "page_count": self.page_count,
+            "failed_pages": self.failed_pages,
+            "retrieval_backend": self.retrieval_backend,
+            "content_hash": self.content_hash,
+            "pages_key": self.pages_key,
             "vector_store_id": self.vector_store_id,
             "file_store_id": self.file_store_id
         }
     
     @classmethod
     def from_dict(cls, data: dict) -> 'PDFFile':
-        """Create a PDFFile instance from a dictionary"""
+        """Create a PDFFile instance from a metadata dictionary"""
         return cls(
             filename=data['filename'],
             title=data['title'],
             author=data['author'], 
-            text_content=data['text_content'],
+            page_count=data.get('page_count'),
+            failed_pages=data.get('failed_pages'),
+            retrieval_backend=data.get('retrieval_backend'),
+            content_hash=data.get('content_hash'),
+            pages_key=data.get('pages_key'),
             vector_store_id=data['vector_store_id'],
             file_store_id=data['file_store_id']
         )
@@ -44,21 +162,34 @@ class PDFFile:
         return f"PDFFile(filename='{self.filename}', title='{self.title}', author='{self.author}')"
 
     @staticmethod
-    def extract_information_from_pdf(doc: PdfReader, filename: str, vector_store_id: str, file_store_id: str) -> 'PDFFile':
+    def extract_information_from_pdf(path: str, filename: str, vector_store_id: str, file_store_id: str, progress: Optional[Callable[[int, int], None]] = None, workers: Optional[int] = None, on_page: Optional[Callable[[int, str], None]] = None) -> 'PDFFile':
+        """Extract metadata and page text; on_page(number, text) and progress(done, total) are called as each page arrives"""
+        with span("pdf_parse"):
+            doc = PdfReader(path)
+            metadata = doc.metadata or {}
+            total = len(doc.pages)
         return_file = PDFFile(
             filename=filename,
             vector_store_id=vector_store_id,
             file_store_id=file_store_id,
-            title=doc.metadata.get('/Title', None),
-            author=doc.metadata.get('/Author', None)
+            title=metadata.get('/Title', None),
+            author=metadata.get('/Author', None),
+            pages=[]
         )
 
-        # Extract full text content
-        full_text = ""
-        for page in doc.pages:
-            page_text = page.extract_text()
-            if page_text.strip():  # Only add non-empty pages
-                full_text += "<br>" + page_text;
+        # Keep every page, even empty or failed ones, so page numbers match the PDF
+        with span("extract"):
+            for page in iter_pages(path, workers):
+                return_file.pages.append(page.text)
+                # Pages may be extracted in worker processes, so their timings are recorded here
+                STAGE_SECONDS.observe(page.seconds, stage="page_extract")
+                PAGES_EXTRACTED.inc(outcome="ok" if page.error is None else "failed")
+                if page.error is not None:
+                    return_file.failed_pages.append(page.number)
+                if on_page is not None:
+                    on_page(page.number, page.text)
+                if progress is not None:
+                    progress(page.number, total)
 
-        return_file.text_content = full_text
-        return return_file
\ No newline at end of file
+        return_file.page_count = len(return_file.pages)
+        return return_file
@@ -0,0 +1,239 @@
+"""Bulk-ingest every PDF under a directory.
+
+    python ingest.py path/to/catalogue --concurrency 8 --workers 4
+
+Progress is recorded in a manifest (by default .ingest_manifest.jsonl in the
+directory), so rerunning after an interruption skips books that finished and
+reuses files already uploaded to OpenAI.
+"""
+from cache import AnswerCache
+from concurrent.futures import ProcessPoolExecutor
+from database import MongoDB
+from file import PDFFile
+from jobs import COPY_CHUNK, save_book
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from openaiclient import OPEN_AI_API
+import argparse
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import time
+
+MAX_RETRIES = 6
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+RETRYABLE = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+PENDING = "pending"
+UPLOADED = "uploaded"
+INDEXED = "indexed"
+DONE = "done"
+FAILED = "failed"
+
+def find_pdfs(directory: str) -> list[str]:
+    """Every .pdf under directory, in a stable order"""
+    found = []
+    for root, _, files in os.walk(directory):
+        found.extend(os.path.join(root, name) for name in files if name.lower().endswith(".pdf"))
+    return sorted(found)
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(COPY_CHUNK):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def extract(path: str, filename: str) -> PDFFile:
+    """Worker task: books are already spread across processes, so extract each one serially"""
+    return PDFFile.extract_information_from_pdf(path, filename, "", "", workers=1)
+
+class Manifest:
+    """Per-book ingestion state, keyed by path relative to the catalogue and kept as an append-only log of updates"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.books = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        update = json.loads(line)
+                    except json.JSONDecodeError:
+                        # The last line of a run killed mid-write
+                        continue
+                    self.books.setdefault(update.pop("key"), {}).update(update)
+
+        # Compact to one line per book, so the log only holds this run's updates on top
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            for key, entry in self.books.items():
+                f.write(json.dumps({"key": key, **entry}) + "\n")
+        os.replace(tmp, path)
+        self.log = open(path, "a")
+
+    def get(self, key: str) -> dict:
+        return self.books.setdefault(key, {"state": PENDING})
+
+    def update(self, key: str, **fields):
+        self.books.setdefault(key, {}).update(fields)
+        self.log.write(json.dumps({"key": key, **fields}) + "\n")
+        self.log.flush()
+
+    def close(self):
+        self.log.close()
+
+async def with_retries(call, *args, **kwargs):
+    """Await an OpenAI call, backing off exponentially (or as the server asks) on rate limits and transient errors"""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await call(*args, **kwargs)
+        except RETRYABLE as e:
+            if attempt == MAX_RETRIES - 1:
+                raise
+
+            delay = min(BASE_DELAY * 2 ** attempt, MAX_DELAY) * (0.5 + random.random())
+            retry_after = getattr(getattr(e, "response", None), "headers", {}).get("retry-after")
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+
+            print(f"  {type(e).__name__}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+class BulkIngester:
+    def __init__(self, db: MongoDB, openai_client: AsyncOpenAI, manifest: Manifest, workers: int, concurrency: int):
+        self.db = db
+        self.openai_client = openai_client
+        self.manifest = manifest
+        self.answer_cache = AnswerCache(db.answers)
+        # Spawned: asyncio.to_thread workers are running when the pool starts, and fork copies their locks
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.uploads = asyncio.Semaphore(concurrency)
+        # Cap books held in memory between extraction and upload
+        self.in_flight = asyncio.Semaphore(workers + concurrency)
+        self.counts = {DONE: 0, "skipped": 0, FAILED: 0, "pages": 0}
+        # Content hashes being ingested in this run, so identical files are only uploaded once
+        self.claimed = {}
+
+    async def run(self, directory: str, paths: list[str]):
+        await asyncio.gather(*(self.ingest(directory, path) for path in paths))
+        self.pool.shutdown()
+
+    async def ingest(self, directory: str, path: str):
+        # Also the book's filename: the base name alone would collide across folders (a/chapter1.pdf, b/chapter1.pdf)
+        key = os.path.relpath(path, directory).replace(os.sep, "/")
+        entry = self.manifest.get(key)
+        if entry["state"] == DONE:
+            self.counts["skipped"] += 1
+            return
+
+        async with self.in_flight:
+            try:
+                await self._ingest(key, path, entry)
+            except Exception as e:
+                print(f"FAILED {key}: {e}")
+                self.manifest.update(key, state=FAILED, error=str(e))
+                self.counts[FAILED] += 1
+
+    async def _ingest(self, key: str, path: str, entry: dict):
+        loop = asyncio.get_running_loop()
+
+        content_hash = await asyncio.to_thread(hash_file, path)
+        existing = await asyncio.to_thread(self.db.get_pdf_by_hash, content_hash)
+        if existing is not None:
+            print(f"skip {key}: same content as {existing.filename}")
+            self.manifest.update(key, state=DONE, content_hash=content_hash, duplicate_of=existing.filename)
+            self.counts["skipped"] += 1
+            return
+
+        if content_hash in self.claimed:
+            print(f"skip {key}: same content as {self.claimed[content_hash]}")
+            self.manifest.update(key, state=DONE, content_hash=content_hash, duplicate_of=self.claimed[content_hash])
+            self.counts["skipped"] += 1
+            return
+        self.claimed[content_hash] = key
+
+        pdf_file = await loop.run_in_executor(self.pool, extract, path, key)
+        pdf_file.content_hash = content_hash
+        if pdf_file.failed_pages:
+            print(f"  {key}: could not extract pages {pdf_file.failed_pages}")
+
+        async with self.uploads:
+            file_store_id = entry.get("file_store_id")
+            if not file_store_id:
+                response = await with_retries(
+                    self.openai_client.files.create,
+                    file=(pdf_file.filename, pdf_file.text_content, "text"),
+                    purpose="assistants"
+                )
+                file_store_id = response.id
+                self.manifest.update(key, state=UPLOADED, content_hash=content_hash, file_store_id=file_store_id)
+
+            vector_store_id = entry.get("vector_store_id")
+            if not vector_store_id:
+                vector_store = await with_retries(self.openai_client.vector_stores.create, name=pdf_file.filename)
+                vector_store_id = vector_store.id
+                self.manifest.update(key, vector_store_id=vector_store_id)
+
+            if entry.get("state") != INDEXED:
+                # The batch call waits until the file is indexed, unlike a single vector_stores.files.create
+                batch = await with_retries(
+                    self.openai_client.vector_stores.file_batches.create_and_poll,
+                    vector_store_id=vector_store_id,
+                    file_ids=[file_store_id]
+                )
+                if batch.file_counts.failed:
+                    raise Exception(f"OpenAI failed to index {pdf_file.filename}")
+                self.manifest.update(key, state=INDEXED)
+
+        pdf_file.file_store_id = file_store_id
+        pdf_file.vector_store_id = vector_store_id
+        await asyncio.to_thread(save_book, self.db, pdf_file, self.answer_cache)
+
+        self.manifest.update(key, state=DONE, pages=pdf_file.page_count, error=None)
+        self.counts[DONE] += 1
+        self.counts["pages"] += pdf_file.page_count
+        print(f"done {key}: {pdf_file.page_count} pages")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="extraction processes")
+    parser.add_argument("--concurrency", type=int, default=4, help="books uploading to OpenAI at once")
+    parser.add_argument("--manifest", help="progress file (default: DIRECTORY/.ingest_manifest.jsonl)")
+    parser.add_argument("--mongo", default="mongodb://localhost:27017/")
+    args = parser.parse_args()
+
+    paths = find_pdfs(args.directory)
+    manifest = Manifest(args.manifest or os.path.join(args.directory, ".ingest_manifest.jsonl"))
+    ingester = BulkIngester(
+        MongoDB(args.mongo),
+        AsyncOpenAI(api_key=OPEN_AI_API),
+        manifest,
+        workers=args.workers,
+        concurrency=args.concurrency
+    )
+
+    print(f"Ingesting {len(paths)} PDFs from {args.directory}")
+    start = time.perf_counter()
+    try:
+        asyncio.run(ingester.run(args.directory, paths))
+    finally:
+        manifest.close()
+    elapsed = time.perf_counter() - start
+
+    counts = ingester.counts
+    print()
+    print(f"{counts[DONE]} ingested, {counts['skipped']} skipped, {counts[FAILED]} failed in {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"{counts['pages'] / elapsed:.1f} pages/s, {counts[DONE] / elapsed * 60:.1f} books/min")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,230 @@
+from cache import AnswerCache
+from concurrent.futures import ThreadPoolExecutor
+from database import MongoDB, new_pages_key
+from file import PDFFile
+from openaiclient import client, uploadFile, indexFile
+from openai import OpenAI
+from locations import build_locator
+from metrics import span, PAYLOAD_BYTES
+from retrieval import build_index, local_scope
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import hashlib
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+UPLOAD_DIR = os.getenv('UPLOAD_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads"))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+
+# Bytes read at a time while spooling an upload to disk
+COPY_CHUNK = 1024 * 1024
+
+# Write extraction progress to Mongo at most once per this many pages
+PROGRESS_INTERVAL = 25
+
+# Pages inserted into pdf_pages at a time while a book is still being extracted
+PAGE_BATCH = 50
+
+# Seconds a process's claim on a job lasts; its heartbeat renews the claim three times per lease
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 60))
+
+QUEUED = "queued"
+EXTRACTING = "extracting"
+UPLOADING = "uploading"
+INDEXING = "indexing"
+DONE = "done"
+FAILED = "failed"
+
+FINISHED_STATES = (DONE, FAILED)
+
+class IngestJobs:
+    """Runs the upload pipeline (extract, upload, index, save) on a background worker pool"""
+
+    def __init__(self, db: MongoDB, openai_client: Optional[OpenAI] = None, workers: int = JOB_WORKERS, answer_cache: Optional[AnswerCache] = None):
+        self.db = db
+        self.answer_cache = answer_cache
+        self.openai_client = openai_client or client
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest")
+        # Identifies this process's claims on jobs, which other server processes share through Mongo
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.heartbeat = None
+        self.lock = threading.Lock()
+        os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+    def _lease(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=JOB_LEASE_SECONDS)
+
+    def submit(self, stream, filename: str) -> dict:
+        """Store the raw upload and queue it for ingestion, unless the same bytes were ingested before"""
+        job_id = uuid.uuid4().hex
+        path = os.path.join(UPLOAD_DIR, job_id + ".pdf")
+
+        digest = hashlib.sha256()
+        with open(path, "wb") as out:
+            while chunk := stream.read(COPY_CHUNK):
+                digest.update(chunk)
+                out.write(chunk)
+        content_hash = digest.hexdigest()
+        PAYLOAD_BYTES.observe(os.path.getsize(path), kind="upload")
+
+        job = self.db.create_job(job_id, filename, path, QUEUED, content_hash=content_hash, owner=self.owner, lease_until=self._lease())
+        while job is None:
+            # The same bytes are being ingested already; follow that job instead of uploading them twice
+            running = self.db.get_active_job(content_hash)
+            if running is not None:
+                print("Upload", filename, "attached to running job", running["_id"])
+                os.remove(path)
+                return running
+            # That job finished in between, so the duplicate check below will find its book
+            job = self.db.create_job(job_id, filename, path, QUEUED, content_hash=content_hash, owner=self.owner, lease_until=self._lease())
+
+        existing = self.db.get_pdf_by_hash(content_hash)
+        if existing is not None:
+            self._finish_duplicate(job, existing)
+            return self.db.get_job(job_id)
+
+        self.executor.submit(self._run, job_id)
+        return job
+
+    def _finish_duplicate(self, job: dict, existing: PDFFile):
+        """Complete a job by pointing it at the book that already has its content"""
+        print("Upload", job["filename"], "matches existing book", existing.filename)
+        self.db.finish_job(job["_id"], state=DONE, duplicate_of=existing.filename, pdf_data=existing.to_dict())
+        os.remove(job["path"])
+
+    def start(self):
+        """Start the heartbeat that keeps this process's job leases alive and adopts jobs whose owner went away"""
+        with self.lock:
+            if self.heartbeat is None:
+                self.heartbeat = threading.Thread(target=self._beat, name="ingest-heartbeat", daemon=True)
+                self.heartbeat.start()
+
+    def _beat(self):
+        while True:
+            try:
+                self.db.renew_job_leases(self.owner, self._lease(), FINISHED_STATES)
+                self.resume()
+            except Exception:
+                traceback.print_exc(file=sys.stderr)
+            time.sleep(JOB_LEASE_SECONDS / 3)
+
+    def resume(self) -> list[str]:
+        """Claim and requeue unfinished jobs whose lease has lapsed, such as those interrupted by a restart"""
+        resumed = []
+        for job in self.db.get_unfinished_jobs(FINISHED_STATES):
+            # The claim is atomic, so a job is only ever adopted by one process
+            if self.db.claim_job(job["_id"], self.owner, self._lease(), FINISHED_STATES) is None:
+                continue
+            print("Resuming ingest job", job["_id"], "from", job["state"])
+            self.executor.submit(self._run, job["_id"])
+            resumed.append(job["_id"])
+        return resumed
+
+    def _run(self, job_id: str):
+        try:
+            with span("ingest_job"):
+                self.run_pipeline(job_id)
+        except Exception as e:
+            print("Stack Trace:")
+            traceback.print_exc(file=sys.stderr)
+            self.db.finish_job(job_id, state=FAILED, error=str(e))
+            # Failed jobs are not retried, so nothing would read the spooled upload or the pages stored so far again
+            job = self.db.get_job(job_id)
+            if os.path.exists(job["path"]):
+                os.remove(job["path"])
+            book = self.db.get_pdf_by_filename(job["filename"])
+            if job.get("pages_key") and (book is None or book.pages_key != job["pages_key"]):
+                self.db.delete_pages(job["pages_key"])
+
+    def run_pipeline(self, job_id: str) -> PDFFile:
+        """Run every remaining stage of a job, skipping OpenAI calls that already completed"""
+        job = self.db.get_job(job_id)
+        filename = job["filename"]
+
+        # Another job may have finished the same content while this one waited
+        existing = self.db.get_pdf_by_hash(job["content_hash"]) if job.get("content_hash") else None
+        if existing is not None:
+            self._finish_duplicate(job, existing)
+            return existing
+
+        self.db.update_job(job_id, state=EXTRACTING)
+
+        def progress(done: int, total: int):
+            if done % PROGRESS_INTERVAL == 0 or done == total:
+                self.db.update_job(job_id, pages_done=done, page_count=total)
+
+        # Pages are stored as they are extracted, under a key no reader sees until save_book switches the record to it.
+        # A resumed job reuses its key; pages it already stored are skipped
+        pages_key = job.get("pages_key")
+        if not pages_key:
+            pages_key = new_pages_key(filename)
+            self.db.update_job(job_id, pages_key=pages_key)
+
+        batch = {}
+        def store(number: int, text: str):
+            batch[number] = text
+            if len(batch) >= PAGE_BATCH:
+                self.db.save_page_batch(pages_key, batch)
+                batch.clear()
+
+        pdf_file = PDFFile.extract_information_from_pdf(job["path"], filename, "", "", progress=progress, on_page=store)
+        self.db.save_page_batch(pages_key, batch)
+        pdf_file.pages_key = pages_key
+
+        file_store_id = job.get("file_store_id")
+        if not file_store_id:
+            self.db.update_job(job_id, state=UPLOADING)
+            file_store_id = uploadFile(pdf_file, filename, self.openai_client)
+            self.db.update_job(job_id, file_store_id=file_store_id)
+
+        vector_store_id = job.get("vector_store_id")
+        if not vector_store_id:
+            self.db.update_job(job_id, state=INDEXING)
+            vector_store_id = indexFile(file_store_id, filename, self.openai_client)
+            self.db.update_job(job_id, vector_store_id=vector_store_id)
+
+        pdf_file.file_store_id = file_store_id
+        pdf_file.vector_store_id = vector_store_id
+        pdf_file.content_hash = job.get("content_hash")
+
+        save_book(self.db, pdf_file, self.answer_cache, pages_saved=True)
+
+        self.db.finish_job(job_id, state=DONE, pdf_data=pdf_file.to_dict())
+        os.remove(job["path"])
+        return pdf_file
+
+def save_book(db: MongoDB, pdf_file: PDFFile, answer_cache: Optional[AnswerCache] = None, pages_saved: bool = False):
+    """Store a fully ingested book, replacing an older upload under the same filename; pages_saved if its pages are already under pdf_file.pages_key"""
+    existing = db.get_pdf_by_filename(pdf_file.filename)
+    if existing is None:
+        db.save_pdf(pdf_file, pages_saved=pages_saved)
+    else:
+        # A re-upload, or an ingestion interrupted mid-save that already owns the record: swap in the new version
+        pdf_file.retrieval_backend = existing.retrieval_backend
+        db.save_pdf(pdf_file, replace=True, pages_saved=pages_saved)
+        if answer_cache is not None and existing.vector_store_id != pdf_file.vector_store_id:
+            # Forget answers from the old vector store and the old local index
+            answer_cache.invalidate(existing.vector_store_id)
+            answer_cache.invalidate(local_scope(existing))
+
+    # The local indexes are cheap to build, so every book gets them whichever backend it uses
+    build_index(pdf_file.filename, pdf_file.pages)
+    build_locator(pdf_file.filename, pdf_file.pages)
+
+def job_to_dict(job: dict) -> dict:
+    """Public view of a job, without server-side paths"""
+    return {
+        "job_id": job["_id"],
+        "filename": job["filename"],
+        "state": job["state"],
+        "pages_done": job.get("pages_done", 0),
+        "page_count": job.get("page_count"),
+        "error": job.get("error"),
+        "duplicate_of": job.get("duplicate_of"),
+        "pdf_data": job.get("pdf_data")
+    }
@@ -0,0 +1,124 @@
+from database import MongoDB
+from file import PDFFile, PAGE_SEPARATOR
+from metrics import timed
+from retrieval import WORD, VersionCache, index_path, publish_version
+from typing import Optional
+import hashlib
+import numpy as np
+import os
+import sys
+
+# Words per shingle; long enough that a match almost always pins down one place in the book
+SHINGLE_WORDS = 8
+
+def _hash(shingle: str) -> int:
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+
+def shingles(text: str) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Hashes of every run of SHINGLE_WORDS words in text, with each run's character span"""
+    spans = [match.span() for match in WORD.finditer(text)]
+    words = [text[start:end].lower() for start, end in spans]
+    count = max(len(words) - SHINGLE_WORDS + 1, 0)
+
+    hashes = np.fromiter(
+        (_hash(" ".join(words[i:i + SHINGLE_WORDS])) for i in range(count)),
+        dtype=np.uint64, count=count
+    )
+    starts = np.fromiter((spans[i][0] for i in range(count)), dtype=np.int32, count=count)
+    ends = np.fromiter((spans[i + SHINGLE_WORDS - 1][1] for i in range(count)), dtype=np.int32, count=count)
+    return hashes, starts, ends
+
+@timed("build_locator")
+def build_locator(book: str, pages: list[str]):
+    """Build and persist a book's page/offset index: every shingle's hash mapped to its page and span"""
+    hashes, numbers, starts, ends = [], [], [], []
+    for number, text in enumerate(pages, start=1):
+        page_hashes, page_starts, page_ends = shingles(text)
+        hashes.append(page_hashes)
+        numbers.append(np.full(len(page_hashes), number, dtype=np.int32))
+        starts.append(page_starts)
+        ends.append(page_ends)
+
+    hashes = np.concatenate(hashes) if hashes else np.zeros(0, dtype=np.uint64)
+    order = np.argsort(hashes, kind="stable")
+
+    def write(path: str):
+        np.save(os.path.join(path, "locator_hashes.npy"), hashes[order])
+        for name, values in (("pages", numbers), ("starts", starts), ("ends", ends)):
+            values = np.concatenate(values) if values else np.zeros(0, dtype=np.int32)
+            np.save(os.path.join(path, f"locator_{name}.npy"), values[order])
+
+    publish_version(index_path(book), "locator", write)
+
+class Locator:
+    """A persisted page/offset index, memory-mapped from disk"""
+
+    def __init__(self, path: str):
+        self.hashes = np.load(os.path.join(path, "locator_hashes.npy"), mmap_mode="r")
+        self.pages = np.load(os.path.join(path, "locator_pages.npy"), mmap_mode="r")
+        self.starts = np.load(os.path.join(path, "locator_starts.npy"), mmap_mode="r")
+        self.ends = np.load(os.path.join(path, "locator_ends.npy"), mmap_mode="r")
+
+    def locate(self, text: str) -> Optional[dict]:
+        """Page and character span of a passage from the book, or None if it can't be placed"""
+        hashes, _, _ = shingles(text)
+        if len(hashes) == 0 or len(self.hashes) == 0:
+            return None
+
+        positions = np.minimum(np.searchsorted(self.hashes, hashes), len(self.hashes) - 1)
+        matched = self.hashes[positions] == hashes
+        if not matched.any():
+            return None
+
+        # Phrases repeated elsewhere in the book match stray places, so only the longest run of
+        # shingles that also follow each other in the book counts
+        pages = self.pages[positions]
+        starts = self.starts[positions]
+        follows = matched[1:] & matched[:-1] & (pages[1:] == pages[:-1]) & (starts[1:] > starts[:-1])
+
+        best, run_start = None, None
+        for i in range(len(hashes)):
+            if not matched[i]:
+                run_start = None
+                continue
+            if run_start is None or not follows[i - 1]:
+                run_start = i
+            if best is None or i - run_start > best[1] - best[0]:
+                best = (run_start, i)
+
+        first, last = best
+        return {
+            "page": int(pages[first]),
+            "start": int(starts[first]),
+            "end": int(self.ends[positions[last]])
+        }
+
+_locators = VersionCache("locator", Locator)
+
+def load_locator(book: str) -> Optional[Locator]:
+    """Open the live version of a book's locator, or None if it hasn't been built"""
+    return _locators.load(book)
+
+@timed("resolve_locations")
+def resolve_locations(db: MongoDB, pdf_file: PDFFile, passages: list[str]) -> list[dict]:
+    """Map file_search result texts to {page, start, end} locations, building the locator if it is missing"""
+    locator = load_locator(pdf_file.filename)
+    if locator is None:
+        pages = [page['text'] for page in db.get_pages(pdf_file, 1, sys.maxsize)]
+        build_locator(pdf_file.filename, pages)
+        locator = load_locator(pdf_file.filename)
+
+    locations = []
+    for passage in passages:
+        # Results can run across pages of the uploaded text, so place each page's part separately
+        for segment in passage.split(PAGE_SEPARATOR):
+            location = locator.locate(segment)
+            if location is not None:
+                locations.append(location)
+
+    return ordered_locations(locations)
+
+def ordered_locations(locations: list[dict]) -> list[dict]:
+    """Locations without duplicates, in reading order"""
+    unique = {(location["page"], location["start"], location["end"]): location for location in locations}
+    return [unique[key] for key in sorted(unique)]
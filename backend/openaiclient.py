@@ -1,53 +1,159 @@
 from openai import OpenAI
 from dotenv import load_dotenv
 from PyPDF2 import PdfReader
-from file import PDFFile
+from file import PDFFile, PAGE_SEPARATOR
+from metrics import span, PAYLOAD_BYTES, STAGE_SECONDS
 import os
+import time
+from typing import Iterator
 
 load_dotenv("./vars.env")
 
 OPEN_AI_API = os.getenv('OPEN_AI_API')
+MODEL = "gpt-4o-mini"
 
 client = OpenAI(api_key=OPEN_AI_API)
 
-def storeFile(file: PDFFile, filename) -> (str, str):
-    fileResponse = client.files.create(
-        file= (
-            filename,
-            file.text_content,
-            "text"
-        ),
-        purpose="assistants"
-    )
+def storeFile(file: PDFFile, filename, openai_client: OpenAI = client) -> (str, str):
+    file_store_id = uploadFile(file, filename, openai_client)
+    vector_store_id = indexFile(file_store_id, filename, openai_client)
 
-    vector_store = client.vector_stores.create(
-        name=filename
-    )
+    return (file_store_id, vector_store_id)
 
-    vectorResponse = client.vector_stores.files.create(
-        file_id=fileResponse.id,
-        vector_store_id=vector_store.id
-    )
+def uploadFile(file: PDFFile, filename, openai_client: OpenAI = client) -> str:
+    """Upload the book text to OpenAI, returning the file id"""
+    text_content = file.text_content
+    PAYLOAD_BYTES.observe(len(text_content.encode("utf-8")), kind="openai_upload")
 
-    return (fileResponse.id, vector_store.id)
+    with span("openai_files_create"):
+        fileResponse = openai_client.files.create(
+            file= (
+                filename,
+                text_content,
+                "text"
+            ),
+            purpose="assistants"
+        )
 
-def query_question(question: str, file_store_id: str, vector_store_id: str) -> str:
-    response = client.responses.create(
-        model="gpt-4o-mini",
-        input=question,
-        tools=[{
-            "type": "file_search",
-            "vector_store_ids": [vector_store_id]
-        }],
-        include=["file_search_call.results"]
-    )
+    return fileResponse.id
+
+def indexFile(file_store_id: str, filename, openai_client: OpenAI = client) -> str:
+    """Create a vector store for an uploaded file, returning the vector store id"""
+    with span("openai_vector_store_create"):
+        vector_store = openai_client.vector_stores.create(
+            name=filename
+        )
+
+    with span("openai_vector_store_file_attach"):
+        vectorResponse = openai_client.vector_stores.files.create(
+            file_id=file_store_id,
+            vector_store_id=vector_store.id
+        )
+
+    return vector_store.id
+
+def query_question(question: str, file_store_id: str, vector_store_id: str, openai_client: OpenAI = client) -> str:
+    with span("openai_responses"):
+        response = openai_client.responses.create(
+            model=MODEL,
+            input=question,
+            tools=[{
+                "type": "file_search",
+                "vector_store_ids": [vector_store_id]
+            }],
+            include=["file_search_call.results"]
+        )
 
     message = ""
     annotations = "";
+    results = []
     for i in response.output:
         if i.type == "file_search_call":
-            annotations = i.results[0].text
+            annotations = _file_search_annotations(i)
+            results = _file_search_results(i)
         if i.type == "message":
             message = i.content[0].text
 
-    return (message, annotations)
+    return (message, annotations, results)
+
+def stream_question(question: str, file_store_id: str, vector_store_id: str, openai_client: OpenAI = client) -> Iterator[tuple[str, str]]:
+    """Yield ("delta", text) as the answer is generated, and ("annotations", text) and ("results", texts) once file_search returns"""
+    start = time.perf_counter()
+    stream = openai_client.responses.create(
+        model=MODEL,
+        input=question,
+        tools=[{
+            "type": "file_search",
+            "vector_store_ids": [vector_store_id]
+        }],
+        include=["file_search_call.results"],
+        stream=True
+    )
+
+    sent_annotations = False
+    first_token = True
+    for event in stream:
+        if event.type == "response.output_text.delta":
+            if first_token:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="openai_responses_first_token")
+                first_token = False
+            yield ("delta", event.delta)
+        elif event.type == "response.output_item.done" and event.item.type == "file_search_call":
+            yield ("annotations", _file_search_annotations(event.item))
+            yield ("results", _file_search_results(event.item))
+            sent_annotations = True
+
+    if not sent_annotations:
+        yield ("annotations", "")
+        yield ("results", [])
+
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="openai_responses_stream")
+
+def query_with_context(question: str, passages: list[dict], openai_client: OpenAI = client) -> str:
+    """Answer from locally retrieved passages instead of file_search"""
+    with span("openai_responses"):
+        response = openai_client.responses.create(
+            model=MODEL,
+            input=_context_prompt(question, passages)
+        )
+
+    return (response.output_text, _passage_annotations(passages))
+
+def stream_with_context(question: str, passages: list[dict], openai_client: OpenAI = client) -> Iterator[tuple[str, str]]:
+    """Streaming query_with_context, yielding the same events as stream_question"""
+    yield ("annotations", _passage_annotations(passages))
+
+    start = time.perf_counter()
+    stream = openai_client.responses.create(
+        model=MODEL,
+        input=_context_prompt(question, passages),
+        stream=True
+    )
+
+    first_token = True
+    for event in stream:
+        if event.type == "response.output_text.delta":
+            if first_token:
+                STAGE_SECONDS.observe(time.perf_counter() - start, stage="openai_responses_first_token")
+                first_token = False
+            yield ("delta", event.delta)
+
+    STAGE_SECONDS.observe(time.perf_counter() - start, stage="openai_responses_stream")
+
+def _context_prompt(question: str, passages: list[dict]) -> str:
+    context = "\n\n".join(f"[Page {p['page']}]\n{p['text']}" for p in passages)
+    return f"Use these excerpts from the book to answer the question.\n\n{context}\n\nQuestion: {question}"
+
+def _passage_annotations(passages: list[dict]) -> str:
+    """Passages joined the same way pages are, so the client can highlight each one"""
+    return PAGE_SEPARATOR.join(p["text"] for p in passages)
+
+def _file_search_annotations(item) -> str:
+    """Text of the top file_search result"""
+    if not item.results:
+        return ""
+    return item.results[0].text
+
+def _file_search_results(item) -> list[str]:
+    """Text of every file_search result"""
+    return [result.text for result in item.results or []]
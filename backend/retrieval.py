@@ -0,0 +1,230 @@
+from collections import Counter, OrderedDict
+from database import MongoDB
+from file import PDFFile
+from metrics import timed
+from typing import Callable, Optional
+import fcntl
+import hashlib
+import json
+import numpy as np
+import os
+import re
+import shutil
+import sys
+import threading
+import uuid
+
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), "indexes"))
+
+# Default retrieval backend for books that don't set their own: "openai" or "local"
+RETRIEVAL_BACKEND = os.getenv('RETRIEVAL_BACKEND', "openai")
+BACKENDS = ("openai", "local")
+
+# Books whose index (and, separately, locator) each process keeps open
+LOADED_BOOKS = int(os.getenv('LOADED_BOOKS', 64))
+
+CHUNK_WORDS = 200
+CHUNK_OVERLAP = 50
+TOP_K = 5
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+WORD = re.compile(r"\w+")
+
+def backend_for(pdf_file: PDFFile) -> str:
+    """Retrieval backend for a book: its own setting, else the global default"""
+    return pdf_file.retrieval_backend or RETRIEVAL_BACKEND
+
+def local_scope(pdf_file: PDFFile) -> str:
+    """Identifier answers from this book's local index are cached under"""
+    # Tied to the content, like a vector store id, so a re-uploaded book never shares answers with the old text
+    return f"local:{pdf_file.filename}:{pdf_file.content_hash or pdf_file.vector_store_id}"
+
+def cache_scope(pdf_file: PDFFile) -> str:
+    """Identifier answers for this book are cached under, given its backend"""
+    if backend_for(pdf_file) == "local":
+        return local_scope(pdf_file)
+    return pdf_file.vector_store_id
+
+def chunk_pages(pages: list[str]) -> list[tuple[int, int, int]]:
+    """Split pages into overlapping word windows, returned as (page, start, end) character spans"""
+    chunks = []
+    step = CHUNK_WORDS - CHUNK_OVERLAP
+    for number, text in enumerate(pages, start=1):
+        words = [match.span() for match in WORD.finditer(text)]
+        for first in range(0, max(len(words) - CHUNK_OVERLAP, 1), step):
+            window = words[first:first + CHUNK_WORDS]
+            if window:
+                chunks.append((number, window[0][0], window[-1][1]))
+    return chunks
+
+def tokenize(text: str) -> list[str]:
+    return WORD.findall(text.lower())
+
+def index_path(book: str) -> str:
+    return os.path.join(INDEX_DIR, hashlib.sha256(book.encode("utf-8")).hexdigest())
+
+def current_version(path: str, name: str) -> Optional[str]:
+    """Directory under path holding the live version of the files called name, or None if none was published"""
+    try:
+        with open(os.path.join(path, name + ".version")) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+def publish_version(path: str, name: str, write: Callable[[str], None]):
+    """Have write fill a fresh directory, then switch readers to it in one atomic rename"""
+    # Other processes may have the live version memory-mapped, so it is never written to in place
+    os.makedirs(path, exist_ok=True)
+    version = f"{name}-{uuid.uuid4().hex}"
+    staging = os.path.join(path, version + ".tmp")
+    os.makedirs(staging)
+    write(staging)
+
+    # Builds of the same book in other threads or processes take turns from here on; otherwise one
+    # build's cleanup could remove another's version between its rename and its pointer switch
+    with open(os.path.join(path, ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        os.rename(staging, os.path.join(path, version))
+
+        previous = current_version(path, name)
+        pointer = os.path.join(path, f"{version}.version.tmp")
+        with open(pointer, "w") as f:
+            f.write(version)
+        os.replace(pointer, os.path.join(path, name + ".version"))
+
+        # Keep the version just replaced for readers that looked it up a moment ago; mapped files outlive their removal
+        for entry in os.listdir(path):
+            if entry.startswith(name + "-") and not entry.endswith(".tmp") and entry not in (version, previous):
+                shutil.rmtree(os.path.join(path, entry), ignore_errors=True)
+
+class VersionCache:
+    """Open files of the live published version for the most recently used books, reopened when a new version goes live"""
+
+    def __init__(self, name: str, open_version: Callable[[str], object], size: int = LOADED_BOOKS):
+        self.name = name
+        self.open_version = open_version
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def load(self, book: str):
+        """The book's open live version, or None if none was published or it has since been removed"""
+        path = index_path(book)
+        # Checked on every load, so a rebuild by any process is picked up here
+        version = current_version(path, self.name)
+        if version is None:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != version:
+                try:
+                    entry = self.entries[path] = (version, self.open_version(os.path.join(path, version)))
+                except FileNotFoundError:
+                    # The live version is gone; report it as missing so the caller rebuilds it
+                    return None
+            self.entries.move_to_end(path)
+            # Evicted versions are unmapped once the last caller using them lets go
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+            return entry[1]
+
+@timed("build_index")
+def build_index(book: str, pages: list[str]) -> int:
+    """Build and persist a BM25 index over a book's chunks, returning the number of chunks"""
+    chunks = chunk_pages(pages)
+
+    vocabulary = {}
+    rows, cols, tfs = [], [], []
+    lengths = np.zeros(len(chunks), dtype=np.float32)
+    for row, (number, start, end) in enumerate(chunks):
+        tokens = tokenize(pages[number - 1][start:end])
+        lengths[row] = len(tokens)
+        for term, tf in Counter(tokens).items():
+            rows.append(row)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+            tfs.append(tf)
+
+    rows = np.asarray(rows, dtype=np.int32)
+    cols = np.asarray(cols, dtype=np.int32)
+    tfs = np.asarray(tfs, dtype=np.float32)
+
+    # Precompute each (term, chunk) BM25 weight so a query is just a sum of columns
+    df = np.bincount(cols, minlength=len(vocabulary))
+    idf = np.log1p((len(chunks) - df + 0.5) / (df + 0.5)).astype(np.float32)
+    average_length = max(float(lengths.mean()), 1.0) if len(chunks) else 1.0
+    norm = K1 * (1 - B + B * lengths[rows] / average_length)
+    weights = idf[cols] * tfs * (K1 + 1) / (tfs + norm)
+
+    # Term-major (CSC) layout: postings for term t are data[indptr[t]:indptr[t + 1]]
+    order = np.argsort(cols, kind="stable")
+    indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(df, out=indptr[1:])
+
+    def write(path: str):
+        np.save(os.path.join(path, "data.npy"), weights[order].astype(np.float32))
+        np.save(os.path.join(path, "indices.npy"), rows[order])
+        np.save(os.path.join(path, "indptr.npy"), indptr)
+        np.save(os.path.join(path, "chunks.npy"), np.asarray(chunks, dtype=np.int32).reshape(-1, 3))
+        with open(os.path.join(path, "vocabulary.json"), "w") as f:
+            json.dump(vocabulary, f)
+
+    publish_version(index_path(book), "bm25", write)
+    return len(chunks)
+
+class LocalIndex:
+    """A persisted BM25 index, memory-mapped from disk"""
+
+    def __init__(self, path: str):
+        self.data = np.load(os.path.join(path, "data.npy"), mmap_mode="r")
+        self.indices = np.load(os.path.join(path, "indices.npy"), mmap_mode="r")
+        self.indptr = np.load(os.path.join(path, "indptr.npy"), mmap_mode="r")
+        self.chunks = np.load(os.path.join(path, "chunks.npy"), mmap_mode="r")
+        with open(os.path.join(path, "vocabulary.json")) as f:
+            self.vocabulary = json.load(f)
+
+    @timed("local_search")
+    def search(self, question: str, k: int = TOP_K) -> list[dict]:
+        """Top-k chunks for a question as {page, start, end, score}"""
+        scores = np.zeros(len(self.chunks), dtype=np.float32)
+        for term in set(tokenize(question)):
+            column = self.vocabulary.get(term)
+            if column is None:
+                continue
+            start, end = self.indptr[column], self.indptr[column + 1]
+            scores[self.indices[start:end]] += self.data[start:end]
+
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{
+            "page": int(self.chunks[i][0]),
+            "start": int(self.chunks[i][1]),
+            "end": int(self.chunks[i][2]),
+            "score": float(scores[i])
+        } for i in top]
+
+_indexes = VersionCache("bm25", LocalIndex)
+
+def load_index(book: str) -> Optional[LocalIndex]:
+    """Open the live version of a book's index, or None if it hasn't been built"""
+    return _indexes.load(book)
+
+def local_passages(db: MongoDB, pdf_file: PDFFile, question: str, k: int = TOP_K) -> list[dict]:
+    """Top-k passages for a question with their text, building the book's index if it is missing"""
+    index = load_index(pdf_file.filename)
+    if index is None:
+        pages = [page['text'] for page in db.get_pages(pdf_file, 1, sys.maxsize)]
+        build_index(pdf_file.filename, pages)
+        index = load_index(pdf_file.filename)
+
+    hits = index.search(question, k)
+    texts = db.get_pages_by_number(pdf_file, [hit['page'] for hit in hits])
+
+    return [{**hit, "text": texts.get(hit['page'], "")[hit['start']:hit['end']]} for hit in hits]
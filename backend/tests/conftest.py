@@ -0,0 +1,67 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+WORKDIR = tempfile.mkdtemp(prefix="bookml-tests-")
+
+# Must be set before the app modules are imported
+os.environ["UPLOAD_DIR"] = os.path.join(WORKDIR, "uploads")
+os.environ["INDEX_DIR"] = os.path.join(WORKDIR, "indexes")
+os.environ.setdefault("OPEN_AI_API", "test")
+
+mongomock = pytest.importorskip("mongomock")
+# Started for the whole session: database.py must see the patched MongoClient when it is first imported
+mongomock.patch(servers=(("localhost", 27017),)).start()
+
+MONGO = "mongodb://localhost:27017/"
+
+# Pages of the book most app tests ask about
+BOOK_PAGES = [
+    "Chapter one introduces the energy of a closed system and how it is conserved over time.",
+    "Chapter two explains how a market finds the price at which supply meets demand for a good.",
+]
+
+@pytest.fixture
+def openai_client():
+    from bench import StubOpenAI
+
+    return StubOpenAI(answer="The answer is forty-two.", results=[])
+
+@pytest.fixture
+def db():
+    from database import MongoDB
+
+    database = MongoDB(MONGO)
+    yield database
+    for collection in (database.collection, database.pages, database.jobs, database.answers):
+        collection.delete_many({})
+
+@pytest.fixture
+def client(db, openai_client):
+    import app
+
+    app.set_openai_client(openai_client)
+    # Keep the ingest heartbeat from adopting jobs the tests leave unfinished
+    app.jobs.heartbeat = True
+    yield app.app.test_client()
+    app.answer_cache.entries.clear()
+
+@pytest.fixture
+def book(db):
+    from file import PDFFile
+    from jobs import save_book
+
+    pdf_file = PDFFile("book.pdf", "vs-book", "file-book", title="Book", pages=BOOK_PAGES)
+    save_book(db, pdf_file)
+    return pdf_file
+
+@pytest.fixture
+def ask(client):
+    """Ask the book a question over the streaming endpoint"""
+    def ask(question: str = "How is a price found?"):
+        return client.get('/api/askquestion_stream', query_string={'title': "Book", 'question': question})
+    return ask
@@ -0,0 +1,54 @@
+import json
+
+def events(response) -> list[tuple[str, object]]:
+    """(event, data) pairs of a server-sent event stream"""
+    parsed = []
+    for block in response.get_data(as_text=True).split("\n\n"):
+        if not block:
+            continue
+        fields = dict(line.split(": ", 1) for line in block.split("\n"))
+        parsed.append((fields["event"], json.loads(fields["data"])))
+    return parsed
+
+def test_stream_sends_deltas_annotations_locations_then_done(ask, openai_client, book):
+    openai_client.results = ["explains how a market finds the price at which supply meets demand"]
+
+    response = ask()
+
+    assert response.mimetype == "text/event-stream"
+    assert events(response) == [
+        ("annotations", openai_client.results[0]),
+        ("locations", [{"page": 2, "start": 12, "end": 78}]),
+        ("delta", "The"),
+        ("delta", " answer"),
+        ("delta", " is"),
+        ("delta", " forty-two."),
+        ("done", {"answer": "The answer is forty-two.", "cached": False}),
+    ]
+
+def test_stream_reports_an_error_and_caches_nothing(ask, openai_client, book):
+    # Fail after the first delta: the stream opens with response.created and the file_search call
+    openai_client.fail_at = 3
+
+    sent = events(ask())
+
+    assert [name for name, _ in sent] == ["annotations", "locations", "delta", "error"]
+    assert sent[-1][1] == "stream interrupted"
+
+    openai_client.fail_at = None
+    assert events(ask())[-1] == ("done", {"answer": "The answer is forty-two.", "cached": False})
+
+def test_cached_answer_is_replayed_without_calling_openai(ask, openai_client, book):
+    openai_client.results = ["introduces the energy of a closed system and how it is conserved"]
+    first = events(ask())
+    calls = len(openai_client.calls)
+
+    replay = events(ask("  how is a PRICE found? "))
+
+    assert len(openai_client.calls) == calls
+    assert replay == [
+        ("delta", "The answer is forty-two."),
+        ("annotations", openai_client.results[0]),
+        ("locations", dict(first)["locations"]),
+        ("done", {"answer": "The answer is forty-two.", "cached": True}),
+    ]
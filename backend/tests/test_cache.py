@@ -0,0 +1,41 @@
+from datetime import datetime, timedelta, timezone
+
+from pymongo.errors import OperationFailure
+
+from cache import AnswerCache
+
+def test_changing_the_ttl_keeps_the_same_index(db):
+    AnswerCache(db.answers, ttl=60)
+    AnswerCache(db.answers, ttl=120)
+
+    indexes = db.answers.index_information()
+    assert indexes['expires_at_1']['expireAfterSeconds'] == 0
+
+def test_index_from_created_at_entries_is_replaced(db):
+    db.answers.create_index('created_at', expireAfterSeconds=60)
+    db.answers.insert_one({'_id': "old", 'vector_store_id': "vs", 'created_at': datetime.now(timezone.utc)})
+
+    AnswerCache(db.answers)
+
+    assert 'created_at_1' not in db.answers.index_information()
+    assert db.answers.find_one({'_id': "old"}) is None
+
+def test_entries_expire(db):
+    cache = AnswerCache(db.answers, ttl=60)
+    cache.put("vs", "model", "What is it?", "An answer", "", [])
+    assert cache.get("vs", "model", "what is  it?") == ("An answer", "", [])
+
+    cache.entries.clear()
+    db.answers.update_many({}, {'$set': {'expires_at': datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert cache.get("vs", "model", "What is it?") is None
+
+def test_index_already_dropped_by_another_process(db, monkeypatch):
+    db.answers.create_index('created_at', expireAfterSeconds=60)
+
+    def dropped_elsewhere(name):
+        raise OperationFailure("index not found with name [created_at_1]", code=27)
+
+    monkeypatch.setattr(db.answers, "drop_index", dropped_elsewhere)
+    AnswerCache(db.answers)
+
+    assert 'expires_at_1' in db.answers.index_information()
@@ -0,0 +1,33 @@
+from PyPDF2 import PageObject
+
+from bench import generate_pdf
+from file import MIN_PAGES_FOR_POOL, PDFFile, iter_pages
+
+def test_failed_page_is_recorded_without_aborting_the_book(tmp_path, monkeypatch):
+    path = str(tmp_path / "book.pdf")
+    generate_pdf(path, 5, seed=1)
+    extract_text = PageObject.extract_text
+
+    def flaky(page, *args, **kwargs):
+        text = extract_text(page, *args, **kwargs)
+        if text.startswith("1-3"):
+            raise ValueError("broken content stream")
+        return text
+
+    monkeypatch.setattr(PageObject, "extract_text", flaky)
+    pdf_file = PDFFile.extract_information_from_pdf(path, "book.pdf", "", "")
+
+    assert pdf_file.failed_pages == [3]
+    assert pdf_file.page_count == 5
+    assert pdf_file.pages[2] == ""
+    assert [page[:3] for i, page in enumerate(pdf_file.pages) if i != 2] == ["1-1", "1-2", "1-4", "1-5"]
+
+def test_pool_yields_pages_in_order(tmp_path):
+    page_count = MIN_PAGES_FOR_POOL + 10
+    path = str(tmp_path / "long.pdf")
+    generate_pdf(path, page_count, words_per_page=20, seed=7)
+
+    pages = list(iter_pages(path, workers=2))
+
+    assert [page.number for page in pages] == list(range(1, page_count + 1))
+    assert all(page.text.startswith(f"7-{page.number}") and page.error is None for page in pages)
@@ -0,0 +1,64 @@
+import asyncio
+from types import SimpleNamespace
+
+from bench import StubOpenAI, generate_pdf
+from ingest import BulkIngester, Manifest, find_pdfs, DONE, PENDING, UPLOADED
+
+class AsyncStubOpenAI:
+    """The calls the bulk ingester awaits, answered by StubOpenAI"""
+
+    def __init__(self):
+        self.stub = StubOpenAI()
+        self.files = SimpleNamespace(create=self._create_file)
+        self.vector_stores = SimpleNamespace(
+            create=self._create_vector_store,
+            file_batches=SimpleNamespace(create_and_poll=self._index)
+        )
+
+    async def _create_file(self, file, purpose):
+        return self.stub.files.create(file=file, purpose=purpose)
+
+    async def _create_vector_store(self, name):
+        return self.stub.vector_stores.create(name=name)
+
+    async def _index(self, vector_store_id, file_ids):
+        for file_id in file_ids:
+            self.stub.vector_stores.files.create(file_id=file_id, vector_store_id=vector_store_id)
+        return SimpleNamespace(file_counts=SimpleNamespace(failed=0))
+
+def test_manifest_replays_its_log(tmp_path):
+    path = str(tmp_path / "manifest.jsonl")
+    manifest = Manifest(path)
+    manifest.update("a.pdf", state=UPLOADED, file_store_id="file-1")
+    manifest.update("b.pdf", state=UPLOADED, file_store_id="file-2")
+    manifest.update("a.pdf", state=DONE, pages=12)
+    manifest.close()
+
+    # A run killed mid-write leaves a partial last line
+    with open(path, "a") as f:
+        f.write('{"key": "b.pdf", "sta')
+
+    reloaded = Manifest(path)
+    assert reloaded.get("a.pdf") == {"state": DONE, "file_store_id": "file-1", "pages": 12}
+    assert reloaded.get("b.pdf") == {"state": UPLOADED, "file_store_id": "file-2"}
+    assert reloaded.get("c.pdf") == {"state": PENDING}
+    reloaded.close()
+
+    # Loading compacts the log to one line per book
+    with open(path) as f:
+        assert len(f.readlines()) == 2
+
+def test_same_name_in_different_folders_are_separate_books(db, tmp_path):
+    for seed, folder in enumerate(("a", "b"), 1):
+        (tmp_path / folder).mkdir()
+        generate_pdf(str(tmp_path / folder / "chapter1.pdf"), 2, seed=seed)
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    ingester = BulkIngester(db, AsyncStubOpenAI(), manifest, workers=1, concurrency=2)
+
+    asyncio.run(ingester.run(str(tmp_path), find_pdfs(str(tmp_path))))
+    manifest.close()
+
+    assert ingester.counts[DONE] == 2
+    for seed, folder in enumerate(("a", "b"), 1):
+        pdf_file = db.get_pdf_by_filename(f"{folder}/chapter1.pdf")
+        assert db.get_pages(pdf_file, 1, 1)[0]["text"].startswith(f"{seed}-1")
@@ -0,0 +1,175 @@
+from datetime import datetime, timedelta, timezone
+import io
+import os
+import shutil
+import threading
+import time
+
+import pytest
+
+from bench import generate_pdf
+import jobs as jobs_module
+from jobs import IngestJobs, UPLOAD_DIR, QUEUED, EXTRACTING, UPLOADING, INDEXING, DONE, FAILED
+
+PAGES = 5
+
+@pytest.fixture
+def pdf_path(tmp_path) -> str:
+    path = str(tmp_path / "book.pdf")
+    generate_pdf(path, PAGES)
+    return path
+
+@pytest.fixture
+def states(db, monkeypatch) -> list[str]:
+    """Every state a job is moved to, in order"""
+    seen = []
+
+    def recording(update):
+        def record(job_id, **fields):
+            if "state" in fields:
+                seen.append(fields["state"])
+            update(job_id, **fields)
+        return record
+
+    monkeypatch.setattr(db, "update_job", recording(db.update_job))
+    monkeypatch.setattr(db, "finish_job", recording(db.finish_job))
+    return seen
+
+def make_jobs(db, openai_client) -> IngestJobs:
+    return IngestJobs(db, openai_client=openai_client, workers=1)
+
+def spool(pdf_path: str, job_id: str) -> str:
+    """Put a PDF where an interrupted job would have left its upload"""
+    path = os.path.join(UPLOAD_DIR, job_id + ".pdf")
+    shutil.copy(pdf_path, path)
+    return path
+
+def test_job_moves_through_every_stage(db, openai_client, pdf_path, states):
+    jobs = make_jobs(db, openai_client)
+    with open(pdf_path, "rb") as f:
+        job = jobs.submit(io.BytesIO(f.read()), "book.pdf")
+    jobs.executor.shutdown(wait=True)
+
+    job = db.get_job(job["_id"])
+    assert states == [EXTRACTING, UPLOADING, INDEXING, DONE]
+    assert job["pages_done"] == PAGES
+    assert job["pdf_data"]["page_count"] == PAGES
+    assert db.get_pdf_by_filename("book.pdf").vector_store_id == job["vector_store_id"]
+    assert not os.path.exists(job["path"])
+
+def test_failed_job_removes_its_upload(db, openai_client, pdf_path, states):
+    openai_client.upload_error = Exception("upload rejected")
+    jobs = make_jobs(db, openai_client)
+    with open(pdf_path, "rb") as f:
+        job = jobs.submit(io.BytesIO(f.read()), "book.pdf")
+    jobs.executor.shutdown(wait=True)
+
+    job = db.get_job(job["_id"])
+    assert states == [EXTRACTING, UPLOADING, FAILED]
+    assert job["error"] == "upload rejected"
+    assert not os.path.exists(job["path"])
+    assert db.get_pdf_by_filename("book.pdf") is None
+    assert db.pages.count_documents({"book": job["pages_key"]}) == 0
+
+def test_pages_are_stored_while_the_book_is_extracted(db, openai_client, pdf_path, monkeypatch):
+    monkeypatch.setattr(jobs_module, "PAGE_BATCH", 2)
+    batches = []
+    save_page_batch = db.save_page_batch
+
+    def record(key, pages):
+        job = db.jobs.find_one({"pages_key": key})
+        batches.append((sorted(pages), job["state"], list(openai_client.calls)))
+        save_page_batch(key, pages)
+
+    monkeypatch.setattr(db, "save_page_batch", record)
+    jobs = make_jobs(db, openai_client)
+    with open(pdf_path, "rb") as f:
+        jobs.submit(io.BytesIO(f.read()), "book.pdf")
+    jobs.executor.shutdown(wait=True)
+
+    assert batches == [([1, 2], EXTRACTING, []), ([3, 4], EXTRACTING, []), ([5], EXTRACTING, [])]
+    pdf_file = db.get_pdf_by_filename("book.pdf")
+    assert len(db.get_pages(pdf_file, 1, PAGES)) == PAGES
+
+def test_identical_uploads_arriving_together_are_ingested_once(db, openai_client, pdf_path, monkeypatch):
+    uploading = threading.Event()
+    release = threading.Event()
+    create_file = openai_client.files.create
+
+    def slow_create(**kwargs):
+        uploading.set()
+        release.wait(5)
+        return create_file(**kwargs)
+
+    monkeypatch.setattr(openai_client.files, "create", slow_create)
+    jobs = make_jobs(db, openai_client)
+    with open(pdf_path, "rb") as f:
+        data = f.read()
+
+    first = jobs.submit(io.BytesIO(data), "book.pdf")
+    assert uploading.wait(5)
+    second = jobs.submit(io.BytesIO(data), "copy of book.pdf")
+    release.set()
+    jobs.executor.shutdown(wait=True)
+
+    assert second["_id"] == first["_id"]
+    assert openai_client.calls.count("files.create") == 1
+    assert db.get_job(first["_id"])["state"] == DONE
+    assert "active" not in db.get_job(first["_id"])
+
+    # Once the first job is done, the same bytes are a duplicate of its book
+    third = jobs.submit(io.BytesIO(data), "another copy.pdf")
+    assert third["duplicate_of"] == "book.pdf"
+
+def test_resume_skips_openai_calls_that_completed(db, openai_client, pdf_path, states):
+    db.create_job("interrupted", "book.pdf", spool(pdf_path, "interrupted"), INDEXING)
+    db.update_job("interrupted", file_store_id="file-earlier")
+    states.clear()
+
+    jobs = make_jobs(db, openai_client)
+    assert jobs.resume() == ["interrupted"]
+    jobs.executor.shutdown(wait=True)
+
+    assert states == [EXTRACTING, INDEXING, DONE]
+    assert "files.create" not in openai_client.calls
+    assert db.get_pdf_by_filename("book.pdf").file_store_id == "file-earlier"
+
+def test_resumed_job_is_claimed_by_one_process(db, openai_client, pdf_path):
+    db.create_job("interrupted", "book.pdf", spool(pdf_path, "interrupted"), QUEUED)
+
+    first = make_jobs(db, openai_client)
+    second = make_jobs(db, openai_client)
+    assert first.resume() == ["interrupted"]
+    assert second.resume() == []
+    first.executor.shutdown(wait=True)
+    second.executor.shutdown(wait=True)
+
+    assert db.get_job("interrupted")["state"] == DONE
+    assert openai_client.calls.count("files.create") == 1
+
+def test_resume_waits_for_the_lease_to_lapse(db, openai_client, pdf_path):
+    now = datetime.now(timezone.utc)
+    db.create_job("running", "a.pdf", spool(pdf_path, "running"), EXTRACTING, owner="elsewhere", lease_until=now + timedelta(minutes=1))
+    db.create_job("abandoned", "b.pdf", spool(pdf_path, "abandoned"), EXTRACTING, owner="elsewhere", lease_until=now - timedelta(minutes=1))
+
+    jobs = make_jobs(db, openai_client)
+    assert jobs.resume() == ["abandoned"]
+    jobs.executor.shutdown(wait=True)
+
+    assert db.get_job("running")["state"] == EXTRACTING
+    assert db.get_job("abandoned")["owner"] == jobs.owner
+
+def test_upload_endpoint_ingests_through_the_injected_client(client, openai_client, pdf_path):
+    with open(pdf_path, "rb") as f:
+        response = client.post('/api/upload', data={'pdf': (f, "book.pdf")})
+    assert response.status_code == 202
+
+    job_id = response.json["job"]["job_id"]
+    for _ in range(500):
+        job = client.get('/api/upload_status', query_string={'job_id': job_id}).json["job"]
+        if job["state"] in (DONE, FAILED):
+            break
+        time.sleep(0.01)
+
+    assert job["state"] == DONE
+    assert openai_client.calls[:3] == ["files.create", "vector_stores.create", "vector_stores.files.create"]
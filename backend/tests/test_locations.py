@@ -0,0 +1,31 @@
+from file import PDFFile
+from jobs import save_book
+from locations import build_locator, load_locator
+
+REFRAIN = "and so the river carried everything down to the sea"
+FILLER = " ".join(f"word{i}" for i in range(60))
+PASSAGE = "the ferry crossed at dawn while merchants argued over the price of salt " + REFRAIN
+
+def test_span_follows_the_longest_run_of_matching_shingles():
+    page = f"{REFRAIN} {FILLER} {PASSAGE} closing words"
+    build_locator("refrain.pdf", ["an unrelated first page", page])
+
+    location = load_locator("refrain.pdf").locate(PASSAGE)
+
+    # The refrain also opens the page, but the span must not stretch back to it
+    assert location["page"] == 2
+    assert location["start"] == page.index(PASSAGE)
+    assert page.index(PASSAGE) + len(PASSAGE) - len(REFRAIN) < location["end"] <= page.index(PASSAGE) + len(PASSAGE)
+
+def test_local_answer_locations_are_in_reading_order(client, db):
+    pages = [
+        "salt was traded along the coast " * 20,
+        "the price of salt rose every winter " * 20,
+        "merchants argued about salt and the price of salt " * 20,
+    ]
+    save_book(db, PDFFile("salt.pdf", "vs-salt", "file-salt", title="Salt", pages=pages, retrieval_backend="local"))
+
+    locations = client.get('/api/askquestion', query_string={'title': "Salt", 'question': "price of salt"}).json["locations"]
+
+    assert len(locations) > 1
+    assert locations == sorted(locations, key=lambda location: (location["page"], location["start"]))
@@ -0,0 +1,19 @@
+from metrics import percentile
+
+def test_answer_cache_exports_request_counters_and_an_entries_gauge(client, ask, book):
+    ask().get_data()
+    ask().get_data()
+
+    text = client.get('/api/metrics').get_data(as_text=True)
+
+    assert "# TYPE bookml_answer_cache_requests_total counter" in text
+    assert 'bookml_answer_cache_requests_total{result="miss"}' in text
+    assert 'bookml_answer_cache_requests_total{result="memory_hit"}' in text
+    assert "# TYPE bookml_answer_cache_entries gauge" in text
+    assert "bookml_answer_cache_entries 1" in text
+
+def test_percentile():
+    samples = [float(n) for n in range(1, 101)]
+    assert percentile(samples, 0.5) == 51.0
+    assert percentile(samples, 0.95) == 96.0
+    assert percentile(samples, 1.0) == 100.0
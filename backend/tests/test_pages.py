@@ -0,0 +1,105 @@
+import pytest
+
+from app import MAX_PAGE_WINDOW, PAGE_WINDOW
+from file import PDFFile, PAGE_SEPARATOR
+
+PAGE_COUNT = 150
+
+@pytest.fixture
+def long_book(db) -> PDFFile:
+    pdf_file = PDFFile("long.pdf", "vs-long", "file-long", title="Long", pages=[f"page {n} text" for n in range(1, PAGE_COUNT + 1)])
+    db.save_pdf(pdf_file)
+    return pdf_file
+
+@pytest.fixture
+def legacy_book(db):
+    """A book stored the old way, as one text_content blob"""
+    db.collection.insert_one({
+        "_id": "old.pdf",
+        "filename": "old.pdf",
+        "title": "Old",
+        "author": None,
+        "vector_store_id": "vs-old",
+        "file_store_id": "file-old",
+        "text_content": "".join(PAGE_SEPARATOR + f"old page {n}" for n in range(1, 4))
+    })
+
+def get_pdf(client, **args):
+    return client.get('/api/get_pdf', query_string=args)
+
+def test_get_pdf_returns_a_default_window(client, long_book):
+    response = get_pdf(client, title="Long")
+
+    assert response.status_code == 200
+    assert (response.json["from"], response.json["to"]) == (1, PAGE_WINDOW)
+    assert [page["page"] for page in response.json["pages"]] == list(range(1, PAGE_WINDOW + 1))
+    assert response.json["pdf_data"]["page_count"] == PAGE_COUNT
+
+def test_get_pdf_clamps_the_window(client, long_book):
+    response = get_pdf(client, title="Long", **{"from": 11, "to": 1000})
+
+    assert response.json["to"] == 10 + MAX_PAGE_WINDOW
+    assert len(response.json["pages"]) == MAX_PAGE_WINDOW
+    assert response.json["pages"][0] == {"page": 11, "text": "page 11 text"}
+
+@pytest.mark.parametrize("first, last", [(0, 5), (10, 9)])
+def test_get_pdf_rejects_invalid_ranges(client, long_book, first, last):
+    assert get_pdf(client, title="Long", **{"from": first, "to": last}).status_code == 400
+
+def test_get_pdf_metadata_only(client, long_book):
+    response = get_pdf(client, title="Long", metadata_only="true")
+
+    assert response.status_code == 200
+    assert "pages" not in response.json
+    assert response.json["pdf_data"]["title"] == "Long"
+
+def test_get_pdf_unknown_title(client):
+    assert get_pdf(client, title="Missing").status_code == 404
+
+def test_legacy_book_is_split_into_pages_on_first_read(client, db, legacy_book):
+    response = get_pdf(client, title="Old")
+
+    assert [page["text"] for page in response.json["pages"]] == ["old page 1", "old page 2", "old page 3"]
+    record = db.collection.find_one({"_id": "old.pdf"})
+    assert record["page_count"] == 3
+    assert "text_content" not in record
+
+def test_migration_tolerates_pages_inserted_by_a_concurrent_read(db, legacy_book):
+    pdf_file = db.get_pdf("Old")
+    # Another request got as far as inserting some of the pages
+    db.save_pages("old.pdf", ["old page 1", "old page 2"])
+
+    pages = db.get_pages(pdf_file, 1, 10)
+
+    assert [page["text"] for page in pages] == ["old page 1", "old page 2", "old page 3"]
+    assert pdf_file.page_count == 3
+
+def test_migration_is_skipped_once_another_read_finished_it(db, legacy_book):
+    first, second = db.get_pdf("Old"), db.get_pdf("Old")
+    db.get_pages(first, 1, 10)
+    # Had the second read migrated again, this page would have been overwritten or duplicated
+    db.pages.update_one({"book": "old.pdf", "page": 1}, {"$set": {"text": "edited"}})
+
+    pages = db.get_pages(second, 1, 10)
+
+    assert second.page_count == 3
+    assert [page["text"] for page in pages] == ["edited", "old page 2", "old page 3"]
+    assert db.pages.count_documents({"book": "old.pdf"}) == 3
+
+def test_reupload_swaps_in_new_pages_without_a_gap(db, long_book, monkeypatch):
+    replacement = PDFFile("long.pdf", "vs-new", "file-new", title="Long", pages=["new first page", "new second page"])
+    replace_one = db.collection.replace_one
+
+    def switch(*args, **kwargs):
+        # Until the record switches, readers still find the whole old book, and the new pages are ready
+        assert len(db.get_pages(db.get_pdf("Long"), 1, PAGE_COUNT)) == PAGE_COUNT
+        assert db.pages.count_documents({"book": replacement.pages_key}) == 2
+        return replace_one(*args, **kwargs)
+
+    monkeypatch.setattr(db.collection, "replace_one", switch)
+    db.save_pdf(replacement, replace=True)
+
+    current = db.get_pdf("Long")
+    assert current.pages_key == replacement.pages_key != long_book.pages_key
+    assert [page["text"] for page in db.get_pages(current, 1, 10)] == ["new first page", "new second page"]
+    assert db.pages.count_documents({"book": long_book.pages_key}) == 0
@@ -0,0 +1,87 @@
+import os
+import shutil
+import threading
+import time
+
+from file import PDFFile
+from locations import build_locator, load_locator, resolve_locations
+from retrieval import LocalIndex, VersionCache, build_index, load_index, index_path, cache_scope, current_version, local_passages
+
+PAGES = ["the energy of a closed system is conserved", "a market finds the price where supply meets demand"]
+
+def test_rebuild_leaves_the_open_index_intact():
+    build_index("rebuilt.pdf", PAGES)
+    before = load_index("rebuilt.pdf")
+
+    build_index("rebuilt.pdf", ["an entirely different book about cells"])
+    after = load_index("rebuilt.pdf")
+
+    assert after is not before
+    assert before.search("market price")[0]["page"] == 2
+    assert after.search("market price") == []
+    assert after.search("cells")[0]["page"] == 1
+
+def test_open_indexes_are_bounded():
+    loaded = VersionCache("bm25", LocalIndex, size=2)
+    for book in ("first.pdf", "second.pdf", "third.pdf"):
+        build_index(book, PAGES)
+    first = loaded.load("first.pdf")
+    loaded.load("second.pdf")
+
+    # Using the first book again keeps it open while the least recently used one is evicted
+    assert loaded.load("first.pdf") is first
+    loaded.load("third.pdf")
+
+    assert list(loaded.entries) == [index_path("first.pdf"), index_path("third.pdf")]
+    assert loaded.load("first.pdf") is first
+
+def test_old_versions_are_cleaned_up():
+    for _ in range(4):
+        build_index("versions.pdf", PAGES)
+        build_locator("versions.pdf", PAGES)
+
+    entries = sorted(os.listdir(index_path("versions.pdf")))
+    # The live and the previous version of each, the two version pointers and the lock file
+    assert len(entries) == 7
+    assert load_locator("versions.pdf").locate("a market finds the price where supply meets demand")["page"] == 2
+
+def test_local_cache_scope_changes_with_the_content():
+    first = PDFFile("book.pdf", "vs-1", "file-1", pages=PAGES, retrieval_backend="local", content_hash="a" * 64)
+    second = PDFFile("book.pdf", "vs-2", "file-2", pages=PAGES, retrieval_backend="local", content_hash="b" * 64)
+
+    assert cache_scope(first) != cache_scope(second)
+
+def test_concurrent_build_cannot_remove_a_version_before_it_goes_live(monkeypatch):
+    build_index("raced.pdf", PAGES)
+    rename = os.rename
+    racing = []
+
+    def rename_then_race(source, target):
+        rename(source, target)
+        if not racing:
+            # Another build of the same book starts between this build's rename and its pointer switch
+            racing.append(threading.Thread(target=build_index, args=("raced.pdf", PAGES)))
+            racing[0].start()
+            time.sleep(0.2)
+
+    monkeypatch.setattr(os, "rename", rename_then_race)
+    build_index("raced.pdf", PAGES)
+    racing[0].join()
+
+    path = index_path("raced.pdf")
+    assert os.path.isdir(os.path.join(path, current_version(path, "bm25")))
+    assert load_index("raced.pdf").search("market price")[0]["page"] == 2
+
+def test_missing_live_version_is_rebuilt(db):
+    pdf_file = PDFFile("healed.pdf", "vs-1", "file-1", title="Healed", pages=PAGES)
+    db.save_pdf(pdf_file)
+    build_index("healed.pdf", PAGES)
+    build_locator("healed.pdf", PAGES)
+    path = index_path("healed.pdf")
+    for name in ("bm25", "locator"):
+        shutil.rmtree(os.path.join(path, current_version(path, name)))
+
+    assert load_index("healed.pdf") is None
+    assert load_locator("healed.pdf") is None
+    assert local_passages(db, pdf_file, "market price")[0]["page"] == 2
+    assert resolve_locations(db, pdf_file, ["the energy of a closed system is conserved"])[0]["page"] == 1
@@ -1,18 +1,17 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useMemo } from 'react';
 
-function BookContent({ text, annotations, handleTextSelection, currentPage}) {
+function BookContent({ pages, locations, handleTextSelection, currentPage}) {
 
     useEffect(() => {
         if (currentPage && currentPage > 0) {
-            const pageElement = document.querySelector(`.page-content:nth-child(${currentPage})`);
+            const pageElement = document.getElementById(`page-${currentPage}`);
             if (pageElement) {
                 pageElement.scrollIntoView({ behavior: 'smooth', block: 'start' });
             }
         }
-    }, [currentPage]);
+    }, [currentPage, pages]);
 
     useEffect(() => {
-        console.log("New Annotations: " + annotations);
         const annotation = document.getElementById('annotation-0');
         if (annotation) {
             annotation.scrollIntoView({
@@ -20,26 +19,29 @@ function BookContent({ text, annotations, handleTextSelection, currentPage}) {
                 block: 'center'
             });
         }
-    }, [annotations]);
+    }, [locations, pages]);
 
-    const generatePages = (text) => {
-        if (!text) return null;
+    // Group highlight spans by page once, so each page only looks at its own
+    const locationsByPage = useMemo(() => {
+        const byPage = {};
+        locations.forEach((location, index) => {
+            (byPage[location.page] = byPage[location.page] || []).push({ ...location, index });
+        });
+        return byPage;
+    }, [locations]);
 
-        // Split text into pages by <br> tags
-        const unFiltedPages = text.split(/<br\s*\/?>/);
-        const pages = unFiltedPages.filter(e => e.trim() !== "");
-
-        const splitAnnotations = annotations.split("<br>");
+    const generatePages = (pages) => {
+        if (!pages || pages.length === 0) return null;
 
         return (
             <div className="book-pages">
-                {pages.map((pageContent, pageIndex) => (
-                    <div key={pageIndex} className="page-content">                 
+                {pages.filter(p => p.text.trim() !== "").map((p) => (
+                    <div key={p.page} id={`page-${p.page}`} className="page-content">                 
                         <div className="page-indicator">
-                            Page {pageIndex + 1}
+                            Page {p.page}
                         </div>
                         <div className="page-text">
-                            {highLightPages(pageContent, splitAnnotations)}
+                            {highLightPage(p.text, locationsByPage[p.page])}
                         </div>
                     </div>
                 ))}
@@ -47,34 +49,29 @@ function BookContent({ text, annotations, handleTextSelection, currentPage}) {
         );
     };
 
-    const highLightPages = (text, splitAnnotations) => {
-        if (!annotations || annotations.length === 0) {
+    // Locations come from the server sorted by start offset
+    const highLightPage = (text, pageLocations) => {
+        if (!pageLocations) {
             return text;
         }
 
-        let splitPage = [];
-        let annotationNum = -1;
-        for (let i in splitAnnotations) {
-            const tmpSplit = text.split(splitAnnotations[i]);
-            if (tmpSplit.length > 1) {
-                splitPage = tmpSplit;
-                annotationNum = i;
-            }
-        }
+        const parts = [];
+        let position = 0;
+        for (const location of pageLocations) {
+            const start = Math.max(location.start, position);
+            if (location.end <= start) continue;
 
-        if (splitPage.length === 0) {
-            return text;
+            parts.push(text.slice(position, start));
+            parts.push(
+                <span key={location.index} className='highlight' id={`annotation-${location.index}`}>
+                    {text.slice(start, location.end)}
+                </span>
+            );
+            position = location.end;
         }
+        parts.push(text.slice(position));
 
-        console.log(splitPage);
-
-        return  (<>
-            {splitPage[0]}
-            <span className='highlight' id={`annotation-${annotationNum}`}>
-                {splitAnnotations[annotationNum]}
-            </span>
-            {splitPage[1]}
-        </>)
+        return <>{parts}</>;
     }
 
     return (
@@ -84,11 +81,11 @@ function BookContent({ text, annotations, handleTextSelection, currentPage}) {
                     className="text-content"
                     onMouseUp={handleTextSelection}
                 >
-                    {generatePages(text)}
+                    {generatePages(pages)}
                 </div>
             </div>
         </div>
     );
 }
 
-export default BookContent; 
\ No newline at end of file
+export default BookContent; 
@@ -6,7 +6,7 @@ import './ChatPanel.css';
 function ChatPanel({ 
     selectedText, 
     setSelectedText, 
-    setAnnotations,
+    setLocations,
     title
 }) {
     const [answer, setAnswer] = useState('');
@@ -14,6 +14,37 @@ function ChatPanel({
     const [isPopupOpen, setIsPopupOpen] = useState(false);
     const question = useRef('');
 
+    // Show the answer as it is generated; resolves once the stream finishes
+    const streamAnswer = (prompt) => new Promise((resolve) => {
+        const source = new EventSource(`/api/askquestion_stream?title=${encodeURIComponent(title)}&question=${encodeURIComponent(prompt)}`);
+        let received = false;
+
+        source.addEventListener('delta', (event) => {
+            received = true;
+            const delta = JSON.parse(event.data);
+            setAnswer(prev => prev + delta);
+        });
+
+        source.addEventListener('locations', (event) => {
+            setLocations(JSON.parse(event.data));
+        });
+
+        source.addEventListener('done', (event) => {
+            setAnswer(JSON.parse(event.data).answer);
+            source.close();
+            resolve();
+        });
+
+        // Named "error" events come from the server; unnamed ones are connection failures
+        source.addEventListener('error', (event) => {
+            setAnswer(event.data
+                ? 'Error: ' + JSON.parse(event.data)
+                : (received ? 'Error: answer stream interrupted' : 'Error connecting to server'));
+            source.close();
+            resolve();
+        });
+    });
+
     const handleQuestionSubmit = async (e) => {
         e.preventDefault();
         const currQuestion = question.current.value;
@@ -32,15 +63,7 @@ function ChatPanel({
                 prompt += "Explain the content and the context of the quotes.";
             }
 
-            const response = await fetch(`/api/askquestion?title=${encodeURIComponent(title)}&question=${encodeURIComponent(prompt)}`);
-            const data = await response.json();
-            
-            if (response.ok) {
-                setAnswer(data.answer);
-                setAnnotations(data.annotations);
-            } else {
-                setAnswer('Error: ' + (data.error || 'Failed to get answer'));
-            }
+            await streamAnswer(prompt);
 
             question.current.value = '';
             setSelectedText([]);
@@ -6,19 +6,22 @@ function PDFList() {
     const [pdfs, setPdfs] = useState([]);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
     const navigate = useNavigate();
 
     useEffect(() => {
         fetchPDFs();
     }, []);
 
-    const fetchPDFs = async () => {
+    const fetchPDFs = async (cursor = null) => {
         try {
-            const response = await fetch('/api/get_all_pdfs');
+            const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+            const response = await fetch(`/api/get_all_pdfs${query}`);
             const data = await response.json();
             
             if (response.ok) {
-                setPdfs(data.pdf_files);
+                setPdfs(prev => cursor ? [...prev, ...data.pdf_files] : data.pdf_files);
+                setNextCursor(data.next_cursor);
             } else {
                 setError(data.error || 'Failed to fetch PDFs');
             }
@@ -65,6 +68,11 @@ function PDFList() {
                     ))}
                 </div>
             )}
+            {nextCursor && (
+                <button className="pdf-list-more" onClick={() => fetchPDFs(nextCursor)}>
+                    Load more
+                </button>
+            )}
         </div>
     );
 }
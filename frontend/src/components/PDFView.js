@@ -5,24 +5,32 @@ import ReactMarkdown from 'react-markdown';
 import BookContent from './BookContent';
 import ChatPanel from './ChatPanel';
 
+// Number of pages requested from the server at a time
+const PAGE_WINDOW = 20;
+
 function PDFView() {
     const [pdfData, setPdfData] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
     const { title } = useParams();
     const [selectedText, setSelectedText] = useState([]);
-    const [annotations, setAnnotations] = useState("");
+    const [locations, setLocations] = useState([]);
     const [currentPage, setCurrentPage] = useState(1);
+    const [pages, setPages] = useState([]);
+    const [windowStart, setWindowStart] = useState(1);
 
-    // Fetch PDF Data
+    // Fetch PDF metadata and the current window of pages
     useEffect(() => {
         const fetchData = async () => {
             try {
-                const response = await fetch(`/api/get_pdf?title=${encodeURIComponent(title)}`);
+                const from = windowStart;
+                const to = windowStart + PAGE_WINDOW - 1;
+                const response = await fetch(`/api/get_pdf?title=${encodeURIComponent(title)}&from=${from}&to=${to}`);
                 const data = await response.json();
                 
                 if (response.ok) {
                     setPdfData(data.pdf_data);
+                    setPages(data.pages);
                 } else {
                     setError(data.error || 'Failed to fetch PDF data');
                 }
@@ -34,7 +42,24 @@ function PDFView() {
         };
 
         fetchData();
-    }, [title]);
+    }, [title, windowStart]);
+
+    // Load a new window when the requested page is outside the current one
+    useEffect(() => {
+        if (!currentPage || currentPage < 1) return;
+        if (currentPage < windowStart || currentPage >= windowStart + PAGE_WINDOW) {
+            setWindowStart(currentPage);
+        }
+    }, [currentPage, windowStart]);
+
+    // Bring the first highlighted passage into the loaded window
+    useEffect(() => {
+        if (locations.length === 0) return;
+        const page = locations[0].page;
+        if (page < windowStart || page >= windowStart + PAGE_WINDOW) {
+            setWindowStart(page);
+        }
+    }, [locations]);
 
     const handleTextSelection = () => {
         const selection = window.getSelection();
@@ -71,6 +96,20 @@ function PDFView() {
                             className="page-input"
                             onChange={(e) => setCurrentPage(parseInt(e.target.value))}
                         />
+                        <div className="page-window-controls">
+                            <button
+                                disabled={windowStart <= 1}
+                                onClick={() => setWindowStart(Math.max(1, windowStart - PAGE_WINDOW))}
+                            >
+                                ← Previous pages
+                            </button>
+                            <button
+                                disabled={pdfData.page_count && windowStart + PAGE_WINDOW > pdfData.page_count}
+                                onClick={() => setWindowStart(windowStart + PAGE_WINDOW)}
+                            >
+                                Next pages →
+                            </button>
+                        </div>
                     </div>
 
                     <div className="search-container">
@@ -97,19 +136,20 @@ function PDFView() {
                     <ChatPanel 
                         selectedText={selectedText}
                         setSelectedText={setSelectedText}
-                        setAnnotations={setAnnotations}
+                        setLocations={setLocations}
                         title={title}
                     />
 
                     <div className="book-metadata">
                         <p>Filename: {pdfData.filename}</p>
+                        {pdfData.page_count && <p>Pages: {pdfData.page_count}</p>}
                     </div>
                 </div>
             </div>
 
             <BookContent 
-                text={pdfData.text_content}
-                annotations={annotations}
+                pages={pages}
+                locations={locations}
                 handleTextSelection={handleTextSelection}
                 currentPage={currentPage}
             />
@@ -10,6 +10,32 @@ function Upload() {
     setSelectedFile(event.target.files[0]);
   };
 
+  const followJob = (jobId) => {
+    const source = new EventSource(`/api/upload_progress?job_id=${encodeURIComponent(jobId)}`);
+
+    source.onmessage = (event) => {
+      const job = JSON.parse(event.data);
+
+      if (job.state === 'done') {
+        setUploadStatus('File uploaded successfully!');
+        setPdfData(job.pdf_data);
+        source.close();
+      } else if (job.state === 'failed') {
+        setUploadStatus(`Upload failed: ${job.error}`);
+        source.close();
+      } else if (job.state === 'extracting' && job.page_count) {
+        setUploadStatus(`Extracting text: page ${job.pages_done} of ${job.page_count}`);
+      } else {
+        setUploadStatus(`Processing: ${job.state}...`);
+      }
+    };
+
+    source.onerror = () => {
+      setUploadStatus('Lost connection while processing upload');
+      source.close();
+    };
+  };
+
   const handleUpload = async () => {
     setPdfData(null);
     if (!selectedFile) {
@@ -33,8 +59,8 @@ function Upload() {
         const data = await response.json();
       
         if (response.ok) {
-            setUploadStatus('File uploaded successfully!');
-            setPdfData(data.pdf_data);
+            setUploadStatus('Upload queued...');
+            followJob(data.job.job_id);
         } else {
             setUploadStatus(`Upload failed: ${data.error}`);
         }